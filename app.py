@@ -1,28 +1,100 @@
-from flask import Flask, render_template_string, jsonify, request, redirect, url_for, send_from_directory
+from flask import Flask, Request, Response, render_template_string, jsonify, request, redirect, url_for, send_file, abort
 import os
-import csv
-import datetime
-import time
+import base64
+import re
+import json
+import queue
 import threading
+import datetime
+from urllib.parse import quote
+from markupsafe import escape
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from sample_store import ARCHIVE_SORTS, RECEIVED_FORMAT, SampleStore
+from sample import Status
+from sample_index import SampleIndex
+from search_index import SearchIndex
+from notes_log import NOTE_FILES, NotesLog
+from file_hashes import FileHashes
+from uploads import UploadFile, remove_stale_uploads
+from blob_store import BlobStore
+from previews import PreviewPool
+from bundles import bundle_folder, sample_entries, samples_csv, stream_zip
+from snapshot_cache import SnapshotCache
+from events import EventBus, ChangeWatcher, diff_rows, format_event
+from ipc import SCANNER_SOCKET, WEB_SOCKET, Channel, Listener
+
+# Stream uploaded files to disk as they arrive instead of buffering them
+class UploadRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = UploadFile(UPLOAD_FOLDER)
+        self.uploads.append(upload)
+        return upload
+
+    # Werkzeug only closes the files of a body it finished parsing; a
+    # truncated, aborted or oversized upload would leave its temp file behind
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for upload in self.uploads:
+                upload.close()
+
 
 app = Flask(__name__)  # Create the Flask app
+app.request_class = UploadRequest
+
+# Set USE_X_SENDFILE=1 when a front server (nginx, Apache) delivers files
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+# Larger requests are refused with 413 before anything is written
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "1024")) * 1024 * 1024
+file_hashes = FileHashes()
 
-# Path to the files
-CHIP_DATA_FILE = "chip_data.csv"
-SCAN_STATUS_FILE = "scan_status.csv"
+# Shared upload folder
 UPLOAD_FOLDER = "samples"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+remove_stale_uploads(UPLOAD_FOLDER)
+blobs = BlobStore(UPLOAD_FOLDER, file_hashes)
+previews = PreviewPool(UPLOAD_FOLDER, file_hashes, lambda dr, text: search_index.text_added(dr, text))
+event_bus = EventBus()
+watcher = ChangeWatcher(event_bus)
+
+# Sample database and scanner link, opened by configure(). The scanner tells
+# us about every scan; we tell it when a new tag is registered.
+store = snapshots = samples = search_index = None
+scanner_link = scanner_listener = None
+configure_lock = threading.Lock()
+
+
+# Function to set the store and scanner link; integrated.py uses it to share
+# in-memory state with a scanner thread in the same process, and the scanner
+# then wakes the watcher directly instead of through a listener
+def configure(sample_store, link, listener=None):
+    global store, snapshots, samples, search_index, scanner_link, scanner_listener
+    store = sample_store
+    snapshots = SnapshotCache(store.signature, app.json.dumps)
+    samples = SampleIndex(store)
+    search_index = SearchIndex(store, UPLOAD_FOLDER)
+    scanner_link = link
+    scanner_listener = listener
+
+
+# Standalone, samples.db and the scanner sockets are opened on the first
+# request, so importing the app opens nothing that configure() replaces
+@app.before_request
+def configure_standalone():
+    with configure_lock:
+        if store is None:
+            configure(SampleStore(), Channel(peer=SCANNER_SOCKET),
+                      Listener(WEB_SOCKET, lambda message: watcher.wake()))
 
 # Function to check for a new scan
 def check_new_scan():
-    if os.path.exists(SCAN_STATUS_FILE):
-        with open(SCAN_STATUS_FILE, "r") as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                if row["new"] == "True":
-                    return row["Sample UID"]
-    return None
+    return store.new_scan_uid()
 
 @app.route('/')
 def display_chip_data():
@@ -87,6 +159,13 @@ def display_chip_data():
             .highlighted {
                 background-color: #bdbdbd !important;
             }
+            .archived-scan {
+                background-color: #bdbdbd;
+                padding: 10px 15px;
+                border-radius: 5px;
+                margin-bottom: 15px;
+                display: none;
+            }
             .scan-button {
                 background-color: #28a745;
                 color: white;
@@ -127,10 +206,42 @@ def display_chip_data():
             td a:hover {
                 text-decoration: underline;
             }
+            .archive-filters, .bulk-actions {
+                text-align: left;
+                margin: 10px 0;
+            }
+            .bulk-actions select, .bulk-actions button {
+                padding: 6px 8px;
+                margin-left: 6px;
+                font-size: 14px;
+            }
+            .archive-filters input, .archive-filters select, .archive-filters button {
+                padding: 6px 8px;
+                margin: 0 6px 6px 0;
+                font-size: 14px;
+            }
+            .load-more {
+                display: none;
+                margin-top: 15px;
+                padding: 8px 20px;
+                font-size: 14px;
+                border: 1px solid #1a73e8;
+                background-color: white;
+                color: #1a73e8;
+                border-radius: 5px;
+                cursor: pointer;
+            }
 
         </style>
         <script>
             let dropdownOpen = false;
+            let renderPending = false;
+            let activeSamples = new Map();
+            let archiveCursor = null;
+            let lastActiveUID = null;
+            let selectedUIDs = new Set();
+            const STATUSES = {{ statuses|tojson }};
+
             function updateStatus(uid, status) {
                 fetch(`/update_status/${uid}`, {
                     method: 'POST',
@@ -141,96 +252,198 @@ def display_chip_data():
                 });
             }
 
-            function fetchChipData() {
-                if (dropdownOpen) return;
-                fetch('/api/data')
-                    .then(response => response.json())
-                    .then(response => {
-                        const data = response.data;
-                        const activeUID = response.active_uid;
-                        const tableBody = document.getElementById('chip-table-body');
-                        tableBody.innerHTML = '';
-                        
-                        data.forEach(chip => {
-                            const highlightClass = chip["Host scan"] === "True" ? "highlighted" : "";
-                            const row = `
-                                <tr class="${highlightClass}">
-                                    <td><a href="/samples/${chip.DR}" target="_blank" id="sample-link-${chip.UID}">${chip.ID || ''}</a></td>
-                                    <td>${chip.UID || ''}</td>
-                                    <td>${chip.FID || ''}</td>
-                                    <td>${chip.PID || ''}</td>
-                                    <td>${chip.SB || ''}</td>
-                                    <td>${chip.TB || ''}</td>
-                                    <td>${chip.TR || ''}</td>
-                                    <td>${chip.DR || ''}</td>
-                                    <td>
-                                        <select class="status-dropdown" onchange="updateStatus('${chip.UID}', this.value)">
-                                            ${["Received", "In Progress", "On Hold", "Report", "Complete"].map(status =>
-                                                `<option value="${status}" ${chip.Status === status ? "selected" : ""}>${status}</option>`
-                                            ).join("")}
-                                        </select>
-                                    </td>
-                                    <td><button class="archive-btn" onclick="archiveSample('${chip.UID}')">Archive</button></td>
-
-                                </tr>
-                            `;
-                            tableBody.innerHTML += row;
-                        });
-
-                        document.querySelectorAll('select.status-dropdown').forEach(select => {
-                            select.addEventListener('focus', () => { dropdownOpen = true; });
-                            select.addEventListener('blur', () => {
-                                setTimeout(() => { dropdownOpen = false; }, 200);  // slight delay to allow clicking
-                            });
-                        });
-
-                        if (activeUID) {
-                            const link = document.getElementById(`sample-link-${activeUID}`);
-                            if (link && confirm("Familiar tag detected. Open sample?")) {
-                                link.click();
-                            }
-                        }
-                    });
+            function renderActive() {
+                if (dropdownOpen) {
+                    renderPending = true;  // redraw once the dropdown closes
+                    return;
+                }
+                renderPending = false;
+                const tableBody = document.getElementById('chip-table-body');
+                let rows = '';
 
+                selectedUIDs.forEach(uid => { if (!activeSamples.has(uid)) selectedUIDs.delete(uid); });
+                activeSamples.forEach(chip => {
+                    const highlightClass = chip["Host scan"] === "True" ? "highlighted" : "";
+                    rows += `
+                        <tr class="${highlightClass}">
+                            <td><input type="checkbox" onchange="toggleSelected('${chip.UID}', this.checked)" ${selectedUIDs.has(chip.UID) ? "checked" : ""}></td>
+                            <td><a href="/samples/${chip.DR}" target="_blank" id="sample-link-${chip.UID}">${chip.ID || ''}</a></td>
+                            <td>${chip.UID || ''}${chip.Station ? ` <em>(${chip.Station})</em>` : ''}</td>
+                            <td>${chip.FID || ''}</td>
+                            <td>${chip.PID || ''}</td>
+                            <td>${chip.SB || ''}</td>
+                            <td>${chip.TB || ''}</td>
+                            <td>${chip.TR || ''}</td>
+                            <td>${chip.DR || ''}</td>
+                            <td>
+                                <select class="status-dropdown" onchange="updateStatus('${chip.UID}', this.value)">
+                                    ${STATUSES.map(status =>
+                                        `<option value="${status}" ${chip.Status === status ? "selected" : ""}>${status}</option>`
+                                    ).join("")}
+                                </select>
+                            </td>
+                            <td><button class="archive-btn" onclick="archiveSample('${chip.UID}')">Archive</button></td>
 
-                fetch('/api/scan_status')
-                    .then(response => response.json())
-                    .then(status => {
-                        let scanButton = document.getElementById('scan-button');
-                        if (status.new_scan) {
-                            scanButton.style.display = "block";
-                            scanButton.onclick = function() {
-                                window.location.href = "/add";
-                            };
-                        } else {
-                            scanButton.style.display = "none";
-                        }
+                        </tr>
+                    `;
+                });
+                tableBody.innerHTML = rows;
+                updateSelection();
+
+                document.querySelectorAll('select.status-dropdown').forEach(select => {
+                    select.addEventListener('focus', () => { dropdownOpen = true; });
+                    select.addEventListener('blur', () => {
+                        setTimeout(() => {  // slight delay to allow clicking
+                            dropdownOpen = false;
+                            if (renderPending) renderActive();
+                        }, 200);
                     });
+                });
+            }
+
+            // Load the first archive page for the current filters, or the next
+            // page when `more` is set
+            function loadArchived(more) {
+                const params = new URLSearchParams();
+                ["pid", "sb", "tb", "from", "to"].forEach(name => {
+                    const value = document.getElementById(`archive-${name}`).value.trim();
+                    if (value) params.set(name, value);
+                });
+                const [sort, order] = document.getElementById('archive-sort').value.split(":");
+                params.set("sort", sort);
+                params.set("order", order);
+                if (more && archiveCursor) params.set("cursor", archiveCursor);
 
-                // Load archived
-                fetch('/api/archived')
+                fetch(`/api/archived?${params}`)
                     .then(response => response.json())
-                    .then(data => {
-                        const tableBody = document.getElementById('archived-body');
-                        tableBody.innerHTML = '';
-                        data.forEach(chip => {
-                            const row = `
-                                <tr>
-                                    <td><a href="/samples/${chip.DR}" target="_blank">${chip.ID || ''}</a></td>
-                                    <td>${chip.UID || ''}</td>
-                                    <td>${chip.FID || ''}</td>
-                                    <td>${chip.PID || ''}</td>
-                                    <td>${chip.SB || ''}</td>
-                                    <td>${chip.TB || ''}</td>
-                                    <td>${chip.TR || ''}</td>
-                                    <td>${chip.DR || ''}</td>
-                                </tr>
-                            `;
-                            tableBody.innerHTML += row;
-                        });
+                    .then(page => {
+                        renderArchived(page.data || [], more);
+                        archiveCursor = page.next_cursor;
+                        document.getElementById('archive-more').style.display = archiveCursor ? "inline-block" : "none";
                     });
             }
 
+            function renderArchived(rows, append) {
+                const tableBody = document.getElementById('archived-body');
+                const html = rows.map(chip => `
+                    <tr>
+                        <td><a href="/samples/${chip.DR}" target="_blank">${chip.ID || ''}</a></td>
+                        <td>${chip.UID || ''}</td>
+                        <td>${chip.FID || ''}</td>
+                        <td>${chip.PID || ''}</td>
+                        <td>${chip.SB || ''}</td>
+                        <td>${chip.TB || ''}</td>
+                        <td>${chip.TR || ''}</td>
+                        <td>${chip.DR || ''}</td>
+                    </tr>
+                `).join("");
+                tableBody.innerHTML = append ? tableBody.innerHTML + html : html;
+            }
+
+            function showScanButton(newScan) {
+                let scanButton = document.getElementById('scan-button');
+                if (newScan) {
+                    scanButton.style.display = "block";
+                    scanButton.onclick = function() {
+                        window.location.href = "/add";
+                    };
+                } else {
+                    scanButton.style.display = "none";
+                }
+            }
+
+            // Offer to open a sample once per host scan, not on every update
+            function promptActiveSample(activeUID) {
+                if (activeUID && activeUID !== lastActiveUID) {
+                    const link = document.getElementById(`sample-link-${activeUID}`);
+                    if (link && confirm("Familiar tag detected. Open sample?")) {
+                        link.click();
+                    }
+                }
+                lastActiveUID = activeUID;
+            }
+
+            // An archived sample's tag has no active row to highlight, so it
+            // is shown above the table with a link to the sample
+            function showArchivedScan(scan) {
+                const notice = document.getElementById('archived-scan');
+                if (!scan) {
+                    notice.style.display = "none";
+                    return;
+                }
+                notice.innerHTML = `Archived sample tag scanned${scan.Station ? ` at ${scan.Station}` : ''}: ` +
+                    `<a href="/samples/${scan.DR}" target="_blank" id="sample-link-${scan.UID}">${scan.ID || scan.UID}</a>`;
+                notice.style.display = "block";
+            }
+
+            function applySnapshot(snapshot) {
+                activeSamples = new Map(snapshot.data.map(chip => [chip.UID, chip]));
+                renderActive();
+                showScanButton(snapshot.new_scan);
+                showArchivedScan(snapshot.archived_scan);
+                promptActiveSample(snapshot.active_uid);
+            }
+
+            function applySampleDiff(diff) {
+                diff.removed.forEach(uid => activeSamples.delete(uid));
+                diff.added.concat(diff.changed).forEach(chip => activeSamples.set(chip.UID, chip));
+                renderActive();
+                if ("archived_scan" in diff) showArchivedScan(diff.archived_scan);
+                if ("active_uid" in diff) promptActiveSample(diff.active_uid);
+            }
+
+            function applyArchivedDiff(diff) {
+                loadArchived(false);  // new rows may land anywhere in the current sort
+            }
+
+            // The server sends a full snapshot on connect and then only changes;
+            // EventSource reconnects by itself and receives a fresh snapshot
+            function subscribe() {
+                const events = new EventSource('/api/events');
+                events.addEventListener('snapshot', e => applySnapshot(JSON.parse(e.data)));
+                events.addEventListener('samples', e => applySampleDiff(JSON.parse(e.data)));
+                events.addEventListener('archived', e => applyArchivedDiff(JSON.parse(e.data)));
+                events.addEventListener('scan', e => showScanButton(JSON.parse(e.data).new_scan));
+            }
+
+            function toggleSelected(uid, checked) {
+                if (checked) selectedUIDs.add(uid); else selectedUIDs.delete(uid);
+                updateSelection();
+            }
+
+            function selectAll(checked) {
+                selectedUIDs = checked ? new Set(activeSamples.keys()) : new Set();
+                renderActive();
+            }
+
+            function updateSelection() {
+                document.getElementById('selected-count').textContent = `${selectedUIDs.size} selected`;
+                document.getElementById('select-all').checked = selectedUIDs.size > 0 && selectedUIDs.size === activeSamples.size;
+            }
+
+            // Bulk actions send the whole selection in one request and one write
+            function batchRequest(url, body) {
+                return fetch(url, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify(body)
+                }).then(response => response.json());
+            }
+
+            function setSelectedStatus() {
+                const status = document.getElementById('bulk-status').value;
+                if (!selectedUIDs.size || !status) return;
+                batchRequest('/api/status/batch', {uids: Array.from(selectedUIDs), status: status});
+            }
+
+            function archiveSelected() {
+                if (!selectedUIDs.size) return;
+                if (confirm(`Are you sure you want to archive ${selectedUIDs.size} samples?`)) {
+                    batchRequest('/api/archive/batch', {uids: Array.from(selectedUIDs)})
+                        .then(() => selectedUIDs.clear());
+                }
+            }
+
             function archiveSample(uid) {
                 if (confirm("Are you sure you want to archive this sample?")) {
                     window.location.href = "/archive/" + uid;
@@ -238,8 +451,8 @@ def display_chip_data():
             }
 
             document.addEventListener("DOMContentLoaded", () => {
-                fetchChipData();
-                setInterval(fetchChipData, 1000);
+                subscribe();
+                loadArchived(false);
             });
         </script>
     </head>
@@ -247,11 +460,22 @@ def display_chip_data():
         <div class="container">
             <h1>Sample Log Book</h1>
             <button id="scan-button" class="scan-button">New Sample Detected</button>
+            <div id="archived-scan" class="archived-scan"></div>
             <div class="section-card">
                 <h2>Active Samples</h2>
+                <div class="bulk-actions">
+                    <span id="selected-count">0 selected</span>
+                    <select id="bulk-status">
+                        <option value="">Set status…</option>
+                        {% for status in statuses %}<option>{{ status }}</option>{% endfor %}
+                    </select>
+                    <button onclick="setSelectedStatus()">Apply to selected</button>
+                    <button class="archive-btn" onclick="archiveSelected()">Archive selected</button>
+                </div>
                 <table>
                     <thead>
                         <tr>
+                            <th><input type="checkbox" id="select-all" onchange="selectAll(this.checked)"></th>
                             <th>Sample ID</th>
                             <th>UID</th>
                             <th>Field #</th>
@@ -270,6 +494,21 @@ def display_chip_data():
 
             <div class="section-card">
                 <h2>Archived Samples</h2>
+                <form class="archive-filters" onsubmit="loadArchived(false); return false;">
+                    <input type="text" id="archive-pid" placeholder="Project #">
+                    <input type="text" id="archive-sb" placeholder="Sampled By">
+                    <input type="text" id="archive-tb" placeholder="Tested By">
+                    <label>From <input type="date" id="archive-from"></label>
+                    <label>To <input type="date" id="archive-to"></label>
+                    <select id="archive-sort">
+                        <option value="dr:desc">Newest received</option>
+                        <option value="dr:asc">Oldest received</option>
+                        <option value="archived:desc">Recently archived</option>
+                        <option value="id:asc">Sample ID</option>
+                        <option value="pid:asc">Project #</option>
+                    </select>
+                    <button type="submit">Filter</button>
+                </form>
                 <table>
                     <thead>
                         <tr>
@@ -285,136 +524,255 @@ def display_chip_data():
                     </thead>
                     <tbody id="archived-body"></tbody>
                 </table>
+                <button id="archive-more" class="load-more" onclick="loadArchived(true)">Load more</button>
             </div>
 
         </div>
     </body>
     </html>
     """
-    return render_template_string(html_content)
+    return render_template_string(html_content, statuses=STATUSES)
 
 @app.route('/update_status/<uid>', methods=['POST'])
 def update_status(uid):
     new_status = request.form.get('status')
-    updated_rows = []
-
-    with open(CHIP_DATA_FILE, 'r') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row['UID'] == uid:
-                row['Status'] = new_status
-            updated_rows.append(row)
-
-    with open(CHIP_DATA_FILE, 'w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=updated_rows[0].keys())
-        writer.writeheader()
-        writer.writerows(updated_rows)
-
+    if new_status not in STATUSES:
+        return f"status must be one of: {', '.join(STATUSES)}", 400
+    store.update_status(uid, new_status)
+    watcher.wake()
     return '', 204
 
 
 @app.route('/api/data')
 def get_chip_data():
-    if not os.path.exists(CHIP_DATA_FILE):
-        return jsonify([])
+    snapshot = snapshots.get("data", build_chip_data)
+    return Response(snapshot.body, mimetype="application/json")
 
-    data = []
-    scan_status = {}
+
+# Function to build the active sample list with host scan flags
+def build_chip_data():
+    data = store.active_samples()
+    scan_status = store.scan_status()
     active_uid = None
 
-    if os.path.exists(SCAN_STATUS_FILE):
-        with open(SCAN_STATUS_FILE, "r") as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                scan_status[row["Sample UID"]] = row["Host scan"]
-                if row["Host scan"] == "True":
-                    active_uid = row["Sample UID"]
+    for uid, status in scan_status.items():
+        if status["host_scan"]:
+            active_uid = uid
+
+    for row in data:
+        status = scan_status.get(row["UID"])
+        row["Host scan"] = "True" if status and status["host_scan"] else "False"
+        row["Station"] = status["station"] if status and status["host_scan"] else None
 
-    with open(CHIP_DATA_FILE, "r") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            row["Host scan"] = scan_status.get(row["UID"], "False")
-            data.append(row)
+    # A scanned tag with no active sample may be an archived sample's
+    archived_scan = None
+    if active_uid is not None and not any(row["UID"] == active_uid for row in data):
+        sample = samples.by_uid(active_uid)
+        if sample:
+            archived_scan = {"UID": active_uid, "ID": sample["ID"], "DR": sample["DR"],
+                             "Station": scan_status[active_uid]["station"]}
 
-    return jsonify({"data": data, "active_uid": active_uid})
+    return {"data": data, "active_uid": active_uid, "archived_scan": archived_scan}
 
 
 @app.route('/api/scan_status')
 def get_scan_status():
-    new_scan_available = False
-    if os.path.exists(SCAN_STATUS_FILE):
-        with open(SCAN_STATUS_FILE, "r") as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                if row["new"] == "True":
-                    new_scan_available = True
-                    break
+    snapshot = snapshots.get("scan_status", build_scan_status)
+    return Response(snapshot.body, mimetype="application/json")
 
-    return jsonify({"new_scan": new_scan_available})
+
+# Function to build the new-scan flag shown as the dashboard button
+def build_scan_status():
+    return {"new_scan": store.new_scan_uid() is not None}
+
+
+# Functions turning two snapshots into the event pushed to browsers
+def diff_chip_data(old, new):
+    added, changed, removed = diff_rows(old["data"], new["data"], key=lambda row: row["UID"])
+    change = {"added": added, "changed": changed, "removed": removed}
+    if old["active_uid"] != new["active_uid"]:
+        change["active_uid"] = new["active_uid"]
+    if old["archived_scan"] != new["archived_scan"]:
+        change["archived_scan"] = new["archived_scan"]
+    if added or changed or removed or "active_uid" in change or "archived_scan" in change:
+        return "samples", change
+    return None
+
+
+# Only the most recently archived samples are watched; browsers reload the
+# archive page they are looking at when this reports new ones
+def diff_archived(old, new):
+    added, changed, removed = diff_rows(old["data"], new["data"], key=lambda row: (row["UID"], row["DR"]))
+    if added:
+        return "archived", {"added": added}
+    return None
+
+
+RECENT_ARCHIVE_QUERY = ((), "archived", True, 20, None)
+
+
+def diff_scan_status(old, new):
+    if old != new:
+        return "scan", new
+    return None
+
+
+watcher.add_source("data", lambda: snapshots.get("data", build_chip_data), diff_chip_data)
+watcher.add_source("archived", lambda: snapshots.get(("archived",) + RECENT_ARCHIVE_QUERY,
+                                                     lambda: build_archive_page(RECENT_ARCHIVE_QUERY)),
+                   diff_archived)
+watcher.add_source("scan_status", lambda: snapshots.get("scan_status", build_scan_status), diff_scan_status)
+
+
+# Server-Sent Events stream: one full snapshot, then only the changes
+@app.route('/api/events')
+def stream_events():
+    watcher.ensure_started()
+    if scanner_listener is not None:
+        scanner_listener.ensure_started()
+    subscriber = event_bus.subscribe()
+
+    def generate():
+        try:
+            data = snapshots.get("data", build_chip_data).rows
+            snapshot = {
+                "data": data["data"],
+                "active_uid": data["active_uid"],
+                "archived_scan": data["archived_scan"],
+                "new_scan": snapshots.get("scan_status", build_scan_status).rows["new_scan"],
+            }
+            yield format_event("snapshot", snapshot)
+            while True:
+                try:
+                    message = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"  # keeps proxies from closing an idle stream
+                    continue
+                if message is None:
+                    return  # fell too far behind; the browser reconnects
+                yield message
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(generate(), mimetype="text/event-stream", headers=headers)
 
 @app.route('/samples/<uid>', methods=['GET', 'POST'])
 def sample_files(uid):
+    if uid.startswith("."):
+        abort(404)
+    previews.ensure_started()
     sample_dir = os.path.join(UPLOAD_FOLDER, uid)
     os.makedirs(sample_dir, exist_ok=True)
 
     # Get sample ID for display
-    sample_id = uid
-    for file_path in [CHIP_DATA_FILE, "archived.csv"]:
-        if os.path.exists(file_path):
-            with open(file_path, "r") as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row["DR"] == uid:
-                        sample_id = row["ID"]
-                        break
+    sample = samples.by_dr(uid)
+    sample_id = sample["ID"] if sample else uid
 
     # Handle file upload
     if request.method == 'POST':
         if 'file' in request.files:
             file = request.files['file']
-            if file.filename:
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(sample_dir, filename))
+            filename = secure_filename(file.filename or "")
+            if reserved_name(filename):
+                return "That file name is reserved for the sample's notes.", 400
+            if filename:
+                # Optional checksum from the client, checked before the file is kept
+                expected = request.form.get('sha256', '').strip().lower()
+                if expected and expected != file.stream.sha256.hexdigest():
+                    return "Upload does not match the expected SHA-256.", 400
+                destination = os.path.join(sample_dir, filename)
+                blobs.store_upload(file.stream, destination)
+                previews.submit(uid, destination)
         elif 'note' in request.form:
             note = request.form['note'].strip()
             if note:
-                timestamp = datetime.datetime.now().strftime("%B %d, %Y %I:%M %p")
-                with open(os.path.join(sample_dir, "notes.txt"), "a") as f:
-                    f.write(f"[{timestamp}] {note}\n")
+                NotesLog(sample_dir).append(note, author=request.form.get('author', '').strip())
+                search_index.note_added(uid)
 
     # Show file list
     file_list = os.listdir(sample_dir)
-    file_list = [f for f in file_list if f != "notes.txt"]
-    files_html = "".join(f'<li><a href="/samples/{uid}/files/{fname}" target="_blank">{fname}</a></li>' for fname in file_list)
+    file_list = [f for f in file_list if not reserved_name(f)]
+    files_html = "".join(
+        f'<li><a href="/samples/{uid}/files/{fname}" target="_blank">{fname}</a> '
+        f'<form method="POST" action="/samples/{uid}/files/{fname}/delete" style="display:inline" '
+        f'onsubmit="return confirm(\'Are you sure you want to delete this file?\')">'
+        f'<button type="submit">Delete</button></form>'
+        f'{format_preview(previews.preview(os.path.join(sample_dir, fname)))}</li>' for fname in file_list)
 
-    # Show notes
+    # Show the newest notes; older ones are fetched from /notes on demand
+    notes, before = NotesLog(sample_dir).newest(NOTES_PAGE_SIZE)
     notes_html = ""
-    notes_path = os.path.join(sample_dir, "notes.txt")
-    if os.path.exists(notes_path):
-        with open(notes_path, "r") as f:
-            notes = f.readlines()
-        notes_html = "<ul>" + "".join(f"<li>{line.strip()}</li>" for line in notes) + "</ul>"
+    if notes:
+        notes_html = '<ul id="notes">' + "".join(format_note(note) for note in notes) + "</ul>"
+        if before is not None:
+            notes_html += f'<button id="older-notes" data-before="{before}" onclick="loadOlderNotes()">Show older notes</button>'
 
     return f"""
     <html>
     <head><title>Files for Sample: {sample_id}</title></head>
     <body>
         <h2>Files for Sample: {sample_id}</h2>
-        <form method="POST" enctype="multipart/form-data">
+        <form id="upload-form" method="POST" enctype="multipart/form-data" onsubmit="return uploadFile(event)">
             <input type="file" name="file" required>
+            <input type="hidden" name="sha256">
             <button type="submit">Upload File</button>
         </form>
         <h3>Uploaded Files:</h3>
         <ul>{files_html}</ul>
+        <a href="/samples/{quote(uid)}/bundle.zip">Download sample as zip</a>
+        {f'| <a href="/projects/{quote(sample["PID"], safe="")}/bundle.zip">Download project {escape(sample["PID"])} as zip</a>' if sample and sample["PID"] else ""}
 
         <h3>Add Note:</h3>
         <form method="POST">
+            <input type="text" name="author" placeholder="Your name"><br>
             <textarea name="note" rows="4" cols="50" placeholder="Enter your note here..." required></textarea><br>
             <button type="submit">Add Note</button>
         </form>
 
         <h3>Notes:</h3>
         {notes_html if notes_html else "<p>No notes yet.</p>"}
+        <script>
+            // Hash the file first: content the server already has is linked
+            // without uploading it again, and new content is sent with its hash
+            async function uploadFile(event) {{
+                const form = event.target;
+                const file = form.file.files[0];
+                if (!window.crypto || !crypto.subtle || form.sha256.value) return true;
+                event.preventDefault();
+                const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+                const sha256 = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+                const response = await fetch('/samples/{quote(uid)}/files/link', {{
+                    method: 'POST',
+                    headers: {{'Content-Type': 'application/json'}},
+                    body: JSON.stringify({{sha256: sha256, filename: file.name}})
+                }});
+                if (response.ok) {{
+                    location.reload();
+                }} else {{
+                    form.sha256.value = sha256;
+                    form.submit();
+                }}
+                return false;
+            }}
+
+            async function loadOlderNotes() {{
+                const button = document.getElementById('older-notes');
+                const response = await fetch(`/samples/{quote(uid)}/notes?before=${{button.dataset.before}}`);
+                const page = await response.json();
+                const list = document.getElementById('notes');
+                page.notes.forEach(note => {{
+                    const item = document.createElement('li');
+                    item.textContent = `[${{note.timestamp}}] ${{note.author ? note.author + ': ' : ''}}${{note.text}}`;
+                    list.appendChild(item);
+                }});
+                if (page.before === null) {{
+                    button.remove();
+                }} else {{
+                    button.dataset.before = page.before;
+                }}
+            }}
+        </script>
 
         <br><a href="/">← Back to Table</a>
     </body>
@@ -422,11 +780,133 @@ def sample_files(uid):
     """
 
 
+# Notes shown per page of a sample's notes, and the most one request may ask for
+NOTES_PAGE_SIZE = 20
+NOTES_MAX_PAGE_SIZE = 200
+
+
+# Function to answer with a zip that is built while it is being sent
+def zip_response(entries, filename):
+    response = Response(stream_zip(entries), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+# One sample's attachments, notes and CSV row as a zip
+@app.route('/samples/<uid>/bundle.zip')
+def sample_bundle(uid):
+    sample = samples.by_dr(uid)
+    if uid.startswith(".") or sample is None:
+        abort(404)
+    return zip_response(sample_entries(UPLOAD_FOLDER, sample), f"{bundle_folder(sample)}.zip")
+
+
+# Every active and archived sample of a project, one folder per sample
+@app.route('/projects/<pid>/bundle.zip')
+def project_bundle(pid):
+    rows = [row for row in store.active_samples() if row["PID"].casefold() == pid.casefold()]
+    after = None
+    while True:
+        page, after = store.query_archived({"PID": pid}, sort="archived", descending=False,
+                                           limit=ARCHIVE_MAX_PAGE_SIZE, after=after)
+        rows += page
+        if after is None:
+            break
+    if not rows:
+        abort(404)
+
+    def entries():
+        yield "samples.csv", samples_csv(rows)
+        for row in rows:
+            yield from sample_entries(UPLOAD_FOLDER, row, bundle_folder(row) + "/")
+    return zip_response(entries(), f"{secure_filename(pid) or 'project'}.zip")
+
+
+# Attach already-stored content to a sample by its SHA-256, without an upload
+@app.route('/samples/<uid>/files/link', methods=['POST'])
+def link_sample_file(uid):
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get("filename") or "")
+    digest = (data.get("sha256") or "").strip().lower()
+    if uid.startswith(".") or not filename:
+        return jsonify({"error": "filename is required"}), 400
+    if reserved_name(filename):
+        return jsonify({"error": "that file name is reserved for the sample's notes"}), 400
+    sample_dir = os.path.join(UPLOAD_FOLDER, uid)
+    os.makedirs(sample_dir, exist_ok=True)
+    destination = os.path.join(sample_dir, filename)
+    if not blobs.link(digest, destination):
+        return jsonify({"error": "unknown content; upload the file"}), 404
+    previews.submit(uid, destination)
+    return jsonify({"filename": filename, "sha256": digest, "references": blobs.refcount(digest)})
+
+
+# Function to tell whether a file name is not an attachment: the notes files
+# are written in place, and hidden names are temp files
+def reserved_name(filename):
+    return filename in NOTE_FILES or filename.startswith(".")
+
 
+# Delete an attachment; its stored content goes once no sample refers to it
+@app.route('/samples/<uid>/files/<filename>/delete', methods=['POST'])
+def delete_sample_file(uid, filename):
+    path = safe_join(os.path.abspath(UPLOAD_FOLDER), uid, filename)
+    if uid.startswith(".") or path is None or reserved_name(filename) or not os.path.isfile(path):
+        abort(404)
+    blobs.release(path)
+    return redirect(f"/samples/{quote(uid)}")
+
+
+# Function to render an attachment's cached preview under its link
+def format_preview(preview):
+    if preview is None:
+        return ""
+    if preview["pending"]:
+        return "<div><em>Preview is being generated…</em></div>"
+    thumbnail = f'<img src="/previews/{preview["thumbnail"]}" alt="First page"><br>' if preview["thumbnail"] else ""
+    return f"<div>{thumbnail}<small>{escape(preview['snippet'])}</small></div>"
+
+
+# First-page thumbnails from the preview cache
+@app.route('/previews/<name>')
+def preview_thumbnail(name):
+    if not re.fullmatch(r"[0-9a-f]{64}\.png", name):
+        abort(404)
+    path = os.path.abspath(previews.thumbnail_path(name))
+    if not os.path.isfile(path):
+        abort(404)
+    return send_file(path, etag=name[:-len(".png")], conditional=True, max_age=86400)
+
+
+# Function to render one note as a list item
+def format_note(note):
+    author = f"{escape(note['author'])}: " if note["author"] else ""
+    return f"<li>[{escape(note['timestamp'])}] {author}{escape(note['text'])}</li>"
+
+
+# Older notes for a sample page, newest first
+@app.route('/samples/<uid>/notes')
+def sample_notes(uid):
+    try:
+        before = int(request.args["before"]) if request.args.get("before") else None
+        limit = min(max(int(request.args.get("limit", NOTES_PAGE_SIZE)), 1), NOTES_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "before and limit must be numbers"}), 400
+    notes, before = NotesLog(os.path.join(UPLOAD_FOLDER, uid)).newest(limit, before)
+    return jsonify({"notes": notes, "before": before})
+
+
+# Serve an attachment with a strong content-hash ETag. Werkzeug answers
+# If-None-Match / If-Modified-Since with 304 and Range requests with 206,
+# and no-cache makes browsers revalidate instead of downloading again
 @app.route('/samples/<uid>/files/<filename>')
 def serve_sample_file(uid, filename):
-    sample_dir = os.path.join(UPLOAD_FOLDER, uid)
-    return send_from_directory(sample_dir, filename)
+    path = safe_join(os.path.abspath(UPLOAD_FOLDER), uid, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = send_file(path, etag=file_hashes.get(path), conditional=True)
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/add', methods=['GET', 'POST'])
 def add_chip_data():
@@ -448,43 +928,10 @@ def add_chip_data():
             "Status": "Received"
         }
 
-        file_exists = os.path.exists(CHIP_DATA_FILE)
-        with open(CHIP_DATA_FILE, "a", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=new_entry.keys())
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(new_entry)
-
-        rows = []
-        with open(SCAN_STATUS_FILE, "r") as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                if row["Sample UID"] == new_scan:
-                    row["new"] = "False"
-                    row["Web scan"] = "True"
-                rows.append(row)
-
-        with open(SCAN_STATUS_FILE, "w", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=["Sample UID", "Web scan", "Host scan", "new"])
-            writer.writeheader()
-            writer.writerows(rows)
-
-        def reset_web_scan():
-            time.sleep(2)
-            updated_rows = []
-            with open(SCAN_STATUS_FILE, "r") as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row["Sample UID"] == new_scan:
-                        row["Web scan"] = "False"
-                    updated_rows.append(row)
-
-            with open(SCAN_STATUS_FILE, "w", newline="") as file:
-                writer = csv.DictWriter(file, fieldnames=["Sample UID", "Web scan", "Host scan", "new"])
-                writer.writeheader()
-                writer.writerows(updated_rows)
-
-        threading.Thread(target=reset_web_scan, daemon=True).start()
+        store.add_sample(new_entry)
+        store.set_scan_status(new_scan, new=False)
+        scanner_link.send("registered", uid=new_scan)  # releases the waiting scanner right away
+        watcher.wake()
 
         return redirect(url_for('display_chip_data'))
 
@@ -544,41 +991,169 @@ def add_chip_data():
 
 @app.route('/archive/<uid>')
 def archive_sample(uid):
-    chip_rows = []
-    archived_row = None
-
-    with open(CHIP_DATA_FILE, "r") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row["UID"] == uid:
-                archived_row = row
-            else:
-                chip_rows.append(row)
-
-    if archived_row:
-        with open("archived.csv", "a", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=archived_row.keys())
-            if os.stat("archived.csv").st_size == 0:
-                writer.writeheader()
-            writer.writerow(archived_row)
-
-        with open(CHIP_DATA_FILE, "w", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=archived_row.keys())
-            writer.writeheader()
-            writer.writerows(chip_rows)
-
+    store.archive(uid)
+    watcher.wake()
     return redirect(url_for('display_chip_data'))
 
 
+# Batch requests may name at most this many samples
+BATCH_LIMIT = 500
+
+# Statuses offered on the dashboard
+STATUSES = [status.value for status in Status]
+
+
+# Function to read the JSON object body of a batch request
+def batch_body():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError("body must be a JSON object")
+    return data
+
+
+# Function to read the UID list of a batch request
+def batch_uids(data):
+    uids = data.get("uids")
+    if not isinstance(uids, list) or not uids or not all(isinstance(uid, str) for uid in uids):
+        raise ValueError("uids must be a non-empty list of UIDs")
+    if len(uids) > BATCH_LIMIT:
+        raise ValueError(f"at most {BATCH_LIMIT} samples per batch")
+    return list(dict.fromkeys(uids))
+
+
+# Set the status of many samples in one transaction. Takes either
+# {"uids": [...], "status": "..."} or {"changes": {uid: status}}
+@app.route('/api/status/batch', methods=['POST'])
+def update_status_batch():
+    try:
+        data = batch_body()
+        if "changes" in data:
+            changes = data["changes"]
+            if not isinstance(changes, dict) or not changes or len(changes) > BATCH_LIMIT:
+                raise ValueError(f"changes must map between 1 and {BATCH_LIMIT} UIDs to a status")
+        else:
+            changes = dict.fromkeys(batch_uids(data), data.get("status"))
+        if not all(status in STATUSES for status in changes.values()):
+            raise ValueError(f"status must be one of: {', '.join(STATUSES)}")
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    results = store.update_statuses(changes)
+    watcher.wake()
+    return jsonify({"updated": [uid for uid, done in results.items() if done],
+                    "missing": [uid for uid, done in results.items() if not done]})
+
+
+# Archive many samples in one transaction
+@app.route('/api/archive/batch', methods=['POST'])
+def archive_batch():
+    try:
+        uids = batch_uids(batch_body())
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    results = store.archive_many(uids)
+    watcher.wake()
+    return jsonify({"archived": [uid for uid, done in results.items() if done],
+                    "missing": [uid for uid, done in results.items() if not done]})
+
+
+# Archive pages are at most this many rows; the default is ARCHIVE_PAGE_SIZE
+ARCHIVE_PAGE_SIZE = 50
+ARCHIVE_MAX_PAGE_SIZE = 500
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Function to check a cursor's sort value against the column it came from:
+# received_at text ("" when undated), a seq, or the text of ID, PID or UID
+def cursor_value_ok(sort, value):
+    if sort == "archived":
+        return is_int(value)
+    if not isinstance(value, str):
+        return False
+    if sort == "dr" and value:
+        try:
+            datetime.datetime.strptime(value, RECEIVED_FORMAT)
+        except ValueError:
+            return False
+    return True
+
+
+# Function to turn /api/archived query arguments into a hashable query
+# (filters, sort, descending, limit, after); raises ValueError on bad input
+def archive_query(args):
+    filters = {}
+    for field, name in (("PID", "pid"), ("SB", "sb"), ("TB", "tb")):
+        if args.get(name):
+            filters[field] = args[name]
+    if args.get("from"):
+        filters["start"] = datetime.date.fromisoformat(args["from"]).isoformat()
+    if args.get("to"):
+        end = datetime.date.fromisoformat(args["to"]) + datetime.timedelta(days=1)
+        filters["end"] = end.isoformat()
+
+    sort = args.get("sort", "dr")
+    if sort not in ARCHIVE_SORTS:
+        raise ValueError(f"sort must be one of: {', '.join(ARCHIVE_SORTS)}")
+    order = args.get("order", "desc")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+    limit = min(max(int(args.get("limit", ARCHIVE_PAGE_SIZE)), 1), ARCHIVE_MAX_PAGE_SIZE)
+
+    after = None
+    if args.get("cursor"):
+        try:
+            after = json.loads(base64.urlsafe_b64decode(args["cursor"].encode("ascii")))
+        except (ValueError, TypeError):
+            raise ValueError("invalid cursor")
+        # A cursor is [sort value, seq], exactly as build_archive_page wrote it
+        if (not isinstance(after, list) or len(after) != 2 or not is_int(after[1])
+                or not cursor_value_ok(sort, after[0])):
+            raise ValueError("invalid cursor")
+        after = tuple(after)
+    return tuple(sorted(filters.items())), sort, order == "desc", limit, after
+
+
+# Function to build one archive page and the cursor for the next one
+def build_archive_page(query):
+    filters, sort, descending, limit, after = query
+    page, next_after = store.query_archived(dict(filters), sort, descending, limit, after)
+    cursor = None
+    if next_after is not None:
+        cursor = base64.urlsafe_b64encode(json.dumps(list(next_after)).encode("utf-8")).decode("ascii")
+    return {"data": page, "next_cursor": cursor}
+
+
+# Search results returned by default, and the most one request may ask for
+SEARCH_LIMIT = 50
+SEARCH_MAX_LIMIT = 200
+
+
+# Search notes and sample fields; every word of q must match
+@app.route('/api/search')
+def search_samples():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", SEARCH_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    previews.ensure_started()
+    return jsonify({"query": query, "results": search_index.search(query, limit)})
+
+
+# Paginated archive: ?pid=&sb=&tb=&from=YYYY-MM-DD&to=YYYY-MM-DD
+# &sort=dr|id|pid|uid|archived&order=asc|desc&limit=&cursor=
 @app.route('/api/archived')
 def get_archived_data():
-    data = []
-    if os.path.exists("archived.csv"):
-        with open("archived.csv", "r") as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                data.append(row)
-    return jsonify(data)
+    try:
+        query = archive_query(request.args)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    snapshot = snapshots.get(("archived",) + query, lambda: build_archive_page(query))
+    return Response(snapshot.body, mimetype="application/json")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+import os
+import re
+import shutil
+import sys
+from file_lock import FileLock
+from file_hashes import FileHashes, sha256_file
+from notes_log import NOTE_FILES
+
+BLOB_DIR = ".blobs"
+SHA256 = re.compile(r"[0-9a-f]{64}")
+
+
+# Content-addressed storage for sample attachments. Each distinct file is
+# kept once as samples/.blobs/<ab>/<sha256>, and every sample folder holding
+# it gets a hard link under the original filename, so pages and downloads
+# work on plain paths. The link count doubles as the reference count: a blob
+# whose only remaining link is its own entry is garbage.
+class BlobStore:
+    def __init__(self, folder, hashes=None):
+        self.folder = folder
+        self.root = os.path.join(folder, BLOB_DIR)
+        self.hashes = hashes or FileHashes()
+        os.makedirs(self.root, exist_ok=True)
+
+    # Locking the blob root keeps the dedupe/gc commands and the web app
+    # from dropping a blob while another process links it
+    def _locked(self):
+        return FileLock(self.root)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return bool(SHA256.fullmatch(digest)) and os.path.exists(self.path(digest))
+
+    # Number of sample files referring to a blob
+    def refcount(self, digest):
+        try:
+            return os.stat(self.path(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    # Function to keep a finished UploadFile at `destination`; when the
+    # content is already stored the temp file is dropped and the blob linked
+    def store_upload(self, upload, destination):
+        digest = upload.sha256.hexdigest()
+        blob = self.path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with self._locked():
+            if not os.path.exists(blob):
+                upload.save_as(blob)
+            self._link(blob, digest, destination)
+        return digest
+
+    # Function to add another reference to stored content; False if unknown
+    def link(self, digest, destination):
+        with self._locked():
+            if not self.has(digest):
+                return False
+            self._link(self.path(digest), digest, destination)
+        return True
+
+    def _link(self, blob, digest, destination):
+        # Notes files are appended to in place, which would change the blob
+        # and every other sample linked to it; hidden names are temp files
+        name = os.path.basename(destination)
+        if name in NOTE_FILES or name.startswith("."):
+            raise ValueError(f"{name} cannot be linked to stored content")
+        replaced = self._blob_of(destination)
+        temp = os.path.join(os.path.dirname(destination), f".{name}.link")
+        if os.path.lexists(temp):
+            os.remove(temp)  # left by an interrupted link
+        try:
+            os.link(blob, temp)
+        except OSError:
+            shutil.copyfile(blob, temp)  # no hard links on this filesystem
+        os.replace(temp, destination)
+        self.hashes.remember(destination, digest)
+        if replaced and replaced != blob:
+            self._collect(replaced)
+
+    # Function to delete a sample file and its blob once nothing refers to it
+    def release(self, path):
+        with self._locked():
+            blob = self._blob_of(path)
+            os.remove(path)
+            if blob:
+                self._collect(blob)
+
+    # The blob a sample file is linked to, if any
+    def _blob_of(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if stat.st_nlink < 2:
+            return None
+        blob = self.path(self.hashes.get(path))
+        return blob if os.path.exists(blob) and os.path.samefile(blob, path) else None
+
+    def _collect(self, blob):
+        try:
+            if os.stat(blob).st_nlink == 1:
+                os.remove(blob)
+        except FileNotFoundError:
+            pass
+
+    # Function to remove every blob no sample refers to; returns bytes freed
+    def gc(self):
+        freed = 0
+        with self._locked():
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    blob = os.path.join(directory, name)
+                    stat = os.stat(blob)
+                    if stat.st_nlink == 1:
+                        os.remove(blob)
+                        freed += stat.st_size
+        return freed
+
+    # Function to move existing attachments into the store, replacing
+    # duplicate copies with links; returns (files, bytes saved)
+    def dedupe(self):
+        files = saved = 0
+        for sample in sorted(os.listdir(self.folder)):
+            sample_dir = os.path.join(self.folder, sample)
+            if sample.startswith(".") or not os.path.isdir(sample_dir):
+                continue
+            for name in sorted(os.listdir(sample_dir)):
+                path = os.path.join(sample_dir, name)
+                if name in NOTE_FILES or name.startswith(".") or not os.path.isfile(path):
+                    continue
+                digest = sha256_file(path)
+                blob = self.path(digest)
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                with self._locked():
+                    if not os.path.exists(blob):
+                        os.link(path, blob)  # adopt the first copy as the blob
+                    elif not os.path.samefile(blob, path):
+                        saved += os.path.getsize(path)
+                        self._link(blob, digest, path)
+                files += 1
+        return files, saved
+
+
+if __name__ == "__main__":
+    blobs = BlobStore("samples")
+    if sys.argv[1:] == ["dedupe"]:
+        files, saved = blobs.dedupe()
+        print(f"Checked {files} files; duplicates replaced with links saved {saved} bytes.")
+    elif sys.argv[1:] == ["gc"]:
+        print(f"Removed unreferenced blobs, freeing {blobs.gc()} bytes.")
+    else:
+        print("Usage: python blob_store.py dedupe|gc")
+        sys.exit(1)
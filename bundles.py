@@ -0,0 +1,89 @@
+import csv
+import io
+import os
+import zipfile
+from werkzeug.utils import secure_filename
+from notes_log import NOTE_FILES, NotesLog
+from sample_store import CHIP_FIELDS
+
+BUNDLE_CHUNK = 256 * 1024
+# Text attachments are deflated; everything else (PDFs, images, archives),
+# usually compressed already, is stored as it is
+DEFLATE_SUFFIXES = (".txt", ".csv", ".json", ".jsonl", ".xml", ".html")
+
+
+# Write target for zipfile that only remembers what was written since the
+# last take(). It has no seek(), so zipfile streams entries with data
+# descriptors and the archive never has to be held or revisited.
+class _ZipSink:
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# Function to yield a zip archive piece by piece from (name, path or bytes)
+# entries; files are read in chunks and nothing goes to a temp file
+def stream_zip(entries):
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for name, source in entries:
+            compress = zipfile.ZIP_DEFLATED if name.lower().endswith(DEFLATE_SUFFIXES) else zipfile.ZIP_STORED
+            if isinstance(source, bytes):
+                archive.writestr(name, source, compress_type=compress)
+            else:
+                info = zipfile.ZipInfo.from_file(source, name)
+                info.compress_type = compress
+                with open(source, "rb") as f, archive.open(info, "w") as target:
+                    for chunk in iter(lambda: f.read(BUNDLE_CHUNK), b""):
+                        target.write(chunk)
+                        yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+
+# Function to turn sample rows into CSV bytes, archived ones marked as such
+def samples_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CHIP_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(dict({"Status": "Archived"}, **row))
+    return buffer.getvalue().encode("utf-8")
+
+
+# Function to list the zip entries for one sample folder under `prefix`:
+# every attachment, the notes as plain text and the sample's CSV row
+def sample_entries(folder, sample, prefix=""):
+    sample_dir = os.path.join(folder, sample["DR"])
+    if os.path.isdir(sample_dir):
+        for name in sorted(os.listdir(sample_dir)):
+            path = os.path.join(sample_dir, name)
+            if name not in NOTE_FILES and not name.startswith(".") and os.path.isfile(path):
+                yield prefix + name, path
+        notes = NotesLog(sample_dir).records()
+        if notes:
+            lines = "".join(f"[{note['timestamp']}] {note['author'] + ': ' if note['author'] else ''}{note['text']}\n"
+                            for note in notes)
+            yield prefix + "notes.txt", lines.encode("utf-8")
+    yield prefix + "sample.csv", samples_csv([sample])
+
+
+# Function to name a sample's folder inside a multi-sample bundle
+def bundle_folder(sample):
+    return secure_filename(f"{sample['ID']} {sample['DR']}") or secure_filename(sample["UID"])
@@ -0,0 +1,110 @@
+import json
+import queue
+import threading
+
+
+# Format one Server-Sent Events message
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+# Pending messages for one /api/events stream. get() returns None once the
+# stream is closed, and the stream should then end.
+class Subscription(queue.Queue):
+    # Function to drop whatever is still queued and end the stream
+    def close(self):
+        with self.mutex:
+            self.queue.clear()
+            self.queue.append(None)
+            self.not_empty.notify()
+
+
+# Fan-out of formatted events to every connected /api/events stream
+class EventBus:
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = Subscription(maxsize=self.max_queued)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        message = format_event(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # A stalled browser must not hold the others back. Its stream
+                # is ended, so its EventSource reconnects for a fresh snapshot
+                self.unsubscribe(subscriber)
+                subscriber.close()
+
+
+# Compare two row lists by key and return the rows that were added, changed
+# or removed
+def diff_rows(old_rows, new_rows, key):
+    old = {key(row): row for row in old_rows}
+    new = {key(row): row for row in new_rows}
+    added = [row for k, row in new.items() if k not in old]
+    changed = [row for k, row in new.items() if k in old and old[k] != row]
+    removed = [k for k in old if k not in new]
+    return added, changed, removed
+
+
+# Single background thread that notices changes to the cached snapshots and
+# publishes only the difference. It re-checks the (cheap) snapshot signature
+# every `interval` seconds to catch writes from other processes, and can be
+# woken immediately after a local write.
+class ChangeWatcher:
+    def __init__(self, bus, interval=0.25):
+        self.bus = bus
+        self.interval = interval
+        self._sources = []
+        self._last = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # fetch() returns a Snapshot; diff(old_rows, new_rows) returns
+    # (event, data) or None when nothing the browser cares about changed
+    def add_source(self, name, fetch, diff):
+        self._sources.append((name, fetch, diff))
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                for name, fetch, diff in self._sources:
+                    self._last[name] = fetch()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            for name, fetch, diff in self._sources:
+                try:
+                    snapshot = fetch()
+                except Exception as error:
+                    print(f"Change watcher could not refresh {name}: {error}")
+                    continue
+                previous = self._last[name]
+                if snapshot is previous:
+                    continue
+                self._last[name] = snapshot
+                change = diff(previous.rows, snapshot.rows)
+                if change:
+                    self.bus.publish(*change)
@@ -0,0 +1,44 @@
+import hashlib
+import threading
+from snapshot_cache import file_signature
+
+HASH_CHUNK = 1024 * 1024
+
+
+# Function to hash a file in chunks, so large files never sit in memory
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# SHA-256 of files, remembered against each file's (mtime, size, inode) so a
+# file is only read again after it changes. Used for strong ETags and for
+# spotting identical uploads.
+class FileHashes:
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._hashes = {}  # path -> (signature, hex digest)
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        signature = file_signature([path])[0]
+        if signature is None:
+            raise FileNotFoundError(path)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = sha256_file(path)
+        self.remember(path, digest, signature)
+        return digest
+
+    # Record a hash computed elsewhere (e.g. while the file was uploaded)
+    def remember(self, path, digest, signature=None):
+        signature = signature or file_signature([path])[0]
+        with self._lock:
+            self._hashes.pop(path, None)
+            self._hashes[path] = (signature, digest)
+            while len(self._hashes) > self.max_entries:
+                del self._hashes[next(iter(self._hashes))]
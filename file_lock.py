@@ -0,0 +1,23 @@
+import fcntl
+import os
+
+
+# Exclusive advisory lock on a file or directory, shared by every process and
+# thread that locks the same path (each acquisition opens its own descriptor,
+# so threads of one process exclude each other too). Locking a directory
+# protects files that are replaced with os.replace inside it.
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDONLY)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        return False
@@ -0,0 +1,39 @@
+import argparse
+import atexit
+import app as web
+import nfc_scanner
+from ipc import LocalChannel
+from memory_store import MemoryStore
+from sample_store import SampleStore
+
+
+# Single-process mode for a one-Pi deployment: the Flask app and the reader
+# stations run together and share one in-memory store, which is persisted
+# to samples.db in the background. No sockets or files sit between a tag
+# read and the dashboard.
+def main():
+    parser = argparse.ArgumentParser(description="Run the web app and the NFC scanner in one process.")
+    parser.add_argument("--host", default="0.0.0.0", help="address to serve on (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=5000, help="port to serve on (default: 5000)")
+    nfc_scanner.add_scanner_arguments(parser)
+    args = parser.parse_args()
+    stations = nfc_scanner.stations_from_args(args, parser)
+
+    store = MemoryStore(SampleStore())
+    atexit.register(store.flush, 5)
+
+    scan_state, threads = nfc_scanner.start_scanner(
+        args, stations, store, LocalChannel(lambda message: web.watcher.wake()))
+
+    def on_web_message(message):
+        if message.get("type") == "registered":
+            scan_state.registered(message.get("uid"))
+
+    web.configure(store, LocalChannel(on_web_message))
+
+    # No debug reloader: it would start a second copy of the scanner
+    web.app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
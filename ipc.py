@@ -0,0 +1,79 @@
+import json
+import os
+import socket
+import threading
+
+# Unix datagram sockets the scanner and the web app listen on
+SCANNER_SOCKET = "scanner.sock"
+WEB_SOCKET = "web.sock"
+
+
+# One end of the scanner/web link. Messages are small JSON datagrams such as
+# {"type": "registered", "uid": "04a1..."}; a peer that is not running is
+# silently skipped, since both sides also keep their state in the store.
+class Channel:
+    def __init__(self, path=None, peer=None):
+        self.path = path
+        self.peer = peer
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        if path:
+            if os.path.exists(path):
+                os.unlink(path)  # left behind by a previous run
+            self.sock.bind(path)
+
+    def send(self, message_type, **fields):
+        fields["type"] = message_type
+        try:
+            self.sock.sendto(json.dumps(fields).encode("utf-8"), socket.MSG_DONTWAIT, self.peer)
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            pass
+
+    # Wait up to `timeout` seconds (forever if None) for the next message
+    def receive(self, timeout=None):
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(4096)
+        except socket.timeout:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def close(self):
+        self.sock.close()
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# Background thread handing every message received on `path` to `handler`
+class Listener:
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                channel = Channel(self.path)
+                self._thread = threading.Thread(target=self._run, args=(channel,), daemon=True)
+                self._thread.start()
+
+    def _run(self, channel):
+        while True:
+            message = channel.receive()
+            if message is not None:
+                self.handler(message)
+
+
+# Same interface as Channel for when both ends live in one process
+# (integrated.py): send() calls the handler directly
+class LocalChannel:
+    def __init__(self, handler):
+        self.handler = handler
+
+    def send(self, message_type, **fields):
+        fields["type"] = message_type
+        self.handler(fields)
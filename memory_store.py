@@ -0,0 +1,286 @@
+import collections
+import datetime
+import queue
+import threading
+from sample import Sample, Status
+from sample_store import ARCHIVE_SORTS, CHIP_LOG_LENGTH, RECEIVED_FORMAT, SCAN_FLAGS
+
+# Sort key for samples whose DR did not parse; they sort before every date
+UNDATED = datetime.datetime.min
+
+
+# In-memory sample and scan state for the integrated daemon, where the web
+# handlers and the scanner thread share one process. It offers the same
+# methods as SampleStore; reads never touch disk, and every change is applied
+# in memory under one lock and then handed to a writer thread that persists
+# it to the backing SampleStore, grouping queued changes into one commit.
+# Samples are held as Sample records and turned into dicts only when read.
+class MemoryStore:
+    def __init__(self, backing):
+        self.backing = backing
+        self.path = backing.path
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._active = {row["UID"]: Sample.from_row(row) for row in backing.active_samples()}
+        self._archived = [Sample.from_row(row) for row in backing.archived_samples()]
+        self._scan = backing.scan_status()
+        self._chip_seq = 0
+        self._chip_log = collections.deque(maxlen=CHIP_LOG_LENGTH)
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._persist, daemon=True)
+        self._writer.start()
+
+    # Memory is the source of truth here, so its generation is the signature
+    def signature(self):
+        return self.generation
+
+    def _changed(self, *uids):
+        for uid in uids:
+            self._chip_seq += 1
+            self._chip_log.append((self._chip_seq, uid))
+
+    def _write(self, method, *args):
+        self.generation += 1
+        self._writes.put((method, args))
+
+    # --- Samples ---
+
+    def active_samples(self):
+        with self._lock:
+            return [sample.to_row() for sample in self._active.values()]
+
+    def archived_samples(self):
+        with self._lock:
+            return [sample.to_row() for sample in self._archived]
+
+    # Same contract as SampleStore.query_archived; a row's position in the
+    # archive list stands in for its archive seq. Dates are compared as
+    # datetimes and only turned into received_at text for the cursor. The
+    # list is only ever appended to, so it is read outside the lock.
+    def query_archived(self, filters=None, sort="dr", descending=True, limit=50, after=None):
+        filters = _date_filters(filters or {})
+        column = ARCHIVE_SORTS[sort]
+        if column == "seq":
+            return self._archived_by_position(filters, descending, limit, after)
+        with self._lock:
+            archived = list(self._archived)
+        rows = [(_sort_value(sample, column, position), position, sample)
+                for position, sample in enumerate(archived, 1) if _matches(sample, filters)]
+        rows.sort(key=lambda item: item[:2], reverse=descending)
+        if after is not None:
+            value, position = after
+            if column == "received_at":
+                value = datetime.datetime.strptime(value, RECEIVED_FORMAT) if value else UNDATED
+            after = (value, position)
+            rows = [item for item in rows if (item[:2] < after if descending else item[:2] > after)]
+
+        page = [sample.to_row() for value, position, sample in rows[:limit]]
+        next_after = None
+        if len(rows) > limit:
+            value, position = rows[limit - 1][:2]
+            if column == "received_at":
+                value = "" if value is UNDATED else value.strftime(RECEIVED_FORMAT)
+            next_after = (value, position)
+        return page, next_after
+
+    # The archive list is already in archive order, so a page is read from
+    # the end (or start) on, without visiting the rest of the archive
+    def _archived_by_position(self, filters, descending, limit, after):
+        with self._lock:
+            count = len(self._archived)
+        if descending:
+            start = count if after is None else min(after[1] - 1, count)
+            positions = range(start, 0, -1)
+        else:
+            positions = range(1 if after is None else after[1] + 1, count + 1)
+        rows = []
+        for position in positions:
+            sample = self._archived[position - 1]
+            if _matches(sample, filters):
+                rows.append((position, sample))
+                if len(rows) > limit:
+                    break
+        page = [sample.to_row() for position, sample in rows[:limit]]
+        next_after = None
+        if len(rows) > limit:
+            position = rows[limit - 1][0]
+            next_after = (position, position)
+        return page, next_after
+
+    def get_active(self, uid):
+        with self._lock:
+            sample = self._active.get(uid)
+            return sample.to_row() if sample else None
+
+    def find_by_dr(self, dr):
+        with self._lock:
+            for sample in list(self._active.values()) + self._archived:
+                if sample.DR == dr:
+                    return sample.to_row()
+        return None
+
+    def samples_for_uid(self, uid):
+        with self._lock:
+            rows = [self._active[uid].to_row()] if uid in self._active else []
+            rows += [sample.to_row() for sample in reversed(self._archived) if sample.UID == uid]
+            return rows
+
+    # Same contract as SampleStore.uid_locations, with list positions as locators
+    def uid_locations(self, uids=None):
+        wanted = None if uids is None else set(uids)
+        with self._lock:
+            rows = [(sample.UID, True, position) for position, sample in enumerate(self._archived, 1)
+                    if wanted is None or sample.UID in wanted]
+            rows += [(uid, False, 0) for uid in self._active if wanted is None or uid in wanted]
+        return rows
+
+    def chip_changes(self, since):
+        with self._lock:
+            if self._chip_log and since + 1 < self._chip_log[0][0]:
+                return self._chip_seq, None
+            return self._chip_seq, {uid for seq, uid in self._chip_log if seq > since}
+
+    def chip_log_position(self):
+        with self._lock:
+            return self._chip_seq
+
+    def add_sample(self, entry):
+        sample = Sample.from_row(dict(entry, Status=entry.get("Status") or ""))
+        with self._lock:
+            if sample.UID in self._active:
+                raise ValueError(f"{sample.UID} is already an active sample")
+            self._active[sample.UID] = sample
+            self._changed(sample.UID)
+            self._write("add_sample", sample.to_row())
+
+    def update_status(self, uid, status):
+        return self.update_statuses({uid: status})[uid]
+
+    def update_statuses(self, changes):
+        with self._lock:
+            results = {}
+            for uid, status in changes.items():
+                sample = self._active.get(uid)
+                results[uid] = sample is not None
+                if sample is not None:
+                    sample.status = Status.parse(status)
+                    self._changed(uid)
+            if any(results.values()):
+                self._write("update_statuses", dict(changes))
+        return results
+
+    def archive(self, uid):
+        return self.archive_many([uid])[uid]
+
+    def archive_many(self, uids):
+        with self._lock:
+            results = {}
+            for uid in uids:
+                sample = self._active.pop(uid, None)
+                results[uid] = sample is not None
+                if sample is None:
+                    continue
+                sample.status = None
+                self._archived.append(sample)
+                self._scan.pop(uid, None)
+                self._changed(uid)
+            if any(results.values()):
+                self._write("archive_many", list(uids))
+        return results
+
+    # --- Scan status ---
+
+    def scan_status(self):
+        with self._lock:
+            return {uid: dict(status) for uid, status in self._scan.items()}
+
+    def get_scan_status(self, uid):
+        with self._lock:
+            status = self._scan.get(uid)
+            return dict(status) if status else None
+
+    def set_scan_status(self, uid, **fields):
+        self.set_scan_statuses({uid: fields})
+
+    def set_scan_statuses(self, changes):
+        with self._lock:
+            for uid, fields in changes.items():
+                status = self._scan.setdefault(uid, dict({flag: False for flag in SCAN_FLAGS}, station=None))
+                for field, value in fields.items():
+                    status[field] = value if field == "station" else bool(value)
+            self._write("set_scan_statuses", {uid: dict(fields) for uid, fields in changes.items()})
+
+    def new_scan_uid(self):
+        with self._lock:
+            for uid, status in self._scan.items():
+                if status["new"]:
+                    return uid
+        return None
+
+    def sync_scan_status(self):
+        with self._lock:
+            for uid in self._active:
+                self._scan.setdefault(uid, dict({flag: False for flag in SCAN_FLAGS}, station=None))
+            for uid in [uid for uid, status in self._scan.items()
+                        if uid not in self._active and not status["new"] and not status["host_scan"]]:
+                del self._scan[uid]
+            self._write("sync_scan_status")
+
+    # --- Persistence ---
+
+    def _persist(self):
+        while True:
+            batch = [self._writes.get()]
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.backing.transaction():
+                    for method, args in batch:
+                        if method is not None:
+                            getattr(self.backing, method)(*args)
+            except Exception as error:
+                print(f"Could not persist {len(batch)} change(s): {error}")
+            for method, args in batch:
+                if method is None:
+                    args[0].set()  # flush() marker
+
+    # Block until everything queued so far is on disk
+    def flush(self, timeout=None):
+        done = threading.Event()
+        self._writes.put((None, (done,)))
+        return done.wait(timeout)
+
+
+# Function to parse the start/end date filters once per query
+def _date_filters(filters):
+    filters = dict(filters)
+    for bound in ("start", "end"):
+        if filters.get(bound):
+            filters[bound] = datetime.datetime.fromisoformat(filters[bound])
+    return filters
+
+
+def _sort_value(sample, column, position):
+    if column == "seq":
+        return position
+    if column == "received_at":
+        return sample.received or UNDATED
+    return sample[column]
+
+
+# Like SampleStore's partition pruning, a date filter leaves out undated samples
+def _matches(sample, filters):
+    for field in ("PID", "SB", "TB"):
+        if filters.get(field) and sample[field].casefold() != filters[field].casefold():
+            return False
+    if filters.get("start") or filters.get("end"):
+        if sample.received is None:
+            return False
+        if filters.get("start") and sample.received < filters["start"]:
+            return False
+        if filters.get("end") and sample.received >= filters["end"]:
+            return False
+    return True
@@ -1,153 +1,155 @@
-import os
-import board
-import busio
-import csv
-import datetime
+import argparse
+import threading
 import time
-from adafruit_pn532.i2c import PN532_I2C
-
-# Initialize I2C interface
-i2c = busio.I2C(board.SCL, board.SDA)
-
-# Create an instance of the PN532 class
-pn532 = PN532_I2C(i2c, debug=False)
-
-# Get firmware version
-ic, ver, rev, support = pn532.firmware_version
-print(f"Found PN532 with firmware version: {ver}.{rev}")
-
-# Configure the reader
-pn532.SAM_configuration()
-
-# File paths
-CHIP_DATA_FILE = "chip_data.csv"
-SCAN_STATUS_FILE = "scan_status.csv"
-
-# Dictionary to store known chip data
-known_chips = {}
-
-# Function to load known chips from the CSV file
-# Function to load known chips from the CSV file
-def load_known_chips():
-    global known_chips  # Ensure we modify the global dictionary
-    known_chips.clear()  # Clear old data before reloading
-
-    if not os.path.exists(CHIP_DATA_FILE):
-        print(f"{CHIP_DATA_FILE} not found. Starting with an empty database.")
-        return
-
-    with open(CHIP_DATA_FILE, "r") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            uid = row["UID"]
-            known_chips[uid] = row  # Reload only current entries
-
-
-# Function to initialize scan_status.csv with known UIDs
-def initialize_scan_status():
-    if not os.path.exists(SCAN_STATUS_FILE):
-        with open(SCAN_STATUS_FILE, "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Sample UID", "Web scan", "Host scan", "new"])  # Write header
-
-    existing_entries = {}
-    with open(SCAN_STATUS_FILE, "r") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            existing_entries[row["Sample UID"]] = row
-
-    with open(SCAN_STATUS_FILE, "w", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Sample UID", "Web scan", "Host scan", "new"])
-        for uid in known_chips:
-            if uid in existing_entries:
-                writer.writerow([uid, existing_entries[uid]["Web scan"], existing_entries[uid]["Host scan"], existing_entries[uid]["new"]])
+from sample_store import SampleStore
+from ipc import SCANNER_SOCKET, WEB_SOCKET, Channel, Listener
+from scan_state import DEBOUNCE_HISTORY, DEBOUNCE_SECONDS, ScanStateMachine, TagDebouncer
+from readers import PN532Reader, SimulatedReader, load_trace
+
+
+# Function to parse a --station value such as "intake=pn532" or
+# "oven=pn532:scl=D3,sda=D2" or "desk=sim:rate=2,new=0.1,dwell=2"
+def parse_station(spec):
+    name, _, backend = spec.partition("=")
+    backend, _, option_text = backend.partition(":")
+    if not name or backend not in ("pn532", "sim"):
+        raise argparse.ArgumentTypeError(f"expected NAME=pn532|sim[:key=value,...], got {spec!r}")
+    options = {}
+    for option in filter(None, option_text.split(",")):
+        key, _, value = option.partition("=")
+        options[key] = value
+    return name, backend, options
+
+
+# Function to build one station's reader backend
+def create_reader(backend, options, store):
+    if backend == "sim":
+        trace = load_trace(options["trace"]) if options.get("trace") else None
+        uids = [row["UID"] for row in store.active_samples() + store.archived_samples()]
+        return SimulatedReader(trace=trace, rate=float(options.get("rate", 1.0)), uids=uids,
+                               new_fraction=float(options.get("new", 0.05)),
+                               dwell=float(options.get("dwell", 0)),
+                               loop=options.get("loop") == "1")
+    return PN532Reader(scl=options.get("scl", "SCL"), sda=options.get("sda", "SDA"))
+
+
+# Function to poll one reader forever. Each station has its own thread, so a
+# slow or busy reader never delays the others. Only tag arrivals and
+# removals are passed on, not every read of a tag resting on the pad.
+def poll_station(station, reader, scan_state, counter, debouncer, quiet):
+    while True:
+        uid = reader.read(timeout=0.1)  # Reduced timeout for faster updates
+        if uid:
+            counter[station] += 1
+        elif not quiet:
+            print(f"No card detected at {station}.")
+        for transition, tag in debouncer.update(uid):
+            if transition == "arrived":
+                scan_state.submit(tag, station)
             else:
-                writer.writerow([uid, "False", "False", "False"])
-
-# Function to update scan status
-def update_scan_status(uid, is_new):
-    load_known_chips()  # Reload the latest chip data
-    initialize_scan_status()  # Reload scan status to detect updates
-
-    rows = []
-    found = False
-    with open(SCAN_STATUS_FILE, "r") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row["Sample UID"] == uid:
-                row["Host scan"] = "True"
-                row["new"] = "True" if is_new else row["new"]
-                found = True
-            rows.append(row)
-
-    if not found and is_new:
-        rows.append({"Sample UID": uid, "Web scan": "False", "Host scan": "True", "new": "True"})
-
-    with open(SCAN_STATUS_FILE, "w", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=["Sample UID", "Web scan", "Host scan", "new"])
-        writer.writeheader()
-        writer.writerows(rows)
-
-    if is_new:
-        while True:
-            load_known_chips()  # Reload chip data to reflect app.py changes
-            with open(SCAN_STATUS_FILE, "r") as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row["Sample UID"] == uid and row["Web scan"] == "True":
-                        break
-                else:
-                    time.sleep(1)
-                    continue
-                break
-        for row in rows:
-            if row["Sample UID"] == uid:
-                row["Host scan"] = "False"
-                row["new"] = "False"
-                row["Web scan"] = "False"  # Ensure Web scan is reset as well
-    else:
-        time.sleep(3)
-        for row in rows:
-            if row["Sample UID"] == uid:
-                row["Host scan"] = "False"
-
-    with open(SCAN_STATUS_FILE, "w", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=["Sample UID", "Web scan", "Host scan", "new"])
-        writer.writeheader()
-        writer.writerows(rows)
-
-# Load known chips at the start
-load_known_chips()
-initialize_scan_status()
-
-print("Waiting for an NFC card...")
-
-# Main loop
-while True:
-    load_known_chips()  # Ensure the latest chip data is used
-    initialize_scan_status()  # Ensure scan status is always up to date
-    
-    uid = pn532.read_passive_target(timeout=0.1)  # Reduced timeout for faster updates
-    if uid:
-        uid_hex = uid.hex()
-        is_new = uid_hex not in known_chips
-        if not is_new:
-            chip_data = known_chips[uid_hex]
-            print(f"""
-Recognized Chip:
-    Sample ID: {chip_data['ID']}
-    UID: {chip_data['UID']}
-    Field #: {chip_data['FID']}
-    Project #: {chip_data['PID']}
-    Sampled By: {chip_data['SB']}
-    Tested By: {chip_data['TB']}
-    Tests Run: {chip_data['TR']}
-    Date Received: {chip_data['DR']}
-            """)
-        else:
-            print("New chip detected")
-            print(f"UID: {uid_hex}")
-        update_scan_status(uid_hex, is_new)
-    else:
-        print("No card detected.")
\ No newline at end of file
+                scan_state.removed(tag, station)
+
+
+# Function to print how fast tags are read and processed, and how far the
+# scan-state worker is behind (a growing backlog means it is saturated)
+def report_stats(scan_state, counter, interval):
+    last_reads, last_processed, last_time = dict(counter), 0, time.monotonic()
+    while True:
+        time.sleep(interval)
+        now = time.monotonic()
+        reads, processed = dict(counter), scan_state.processed
+        elapsed = now - last_time
+        per_station = "  ".join(f"{station}: {(reads[station] - last_reads[station]) / elapsed:.1f}"
+                                for station in reads)
+        print(f"reads/s [{per_station}]  "
+              f"processed/s: {(processed - last_processed) / elapsed:.1f}  "
+              f"backlog: {scan_state.events.qsize()}")
+        last_reads, last_processed, last_time = reads, processed, now
+
+
+# Function to add the reader and scan options shared with integrated.py
+def add_scanner_arguments(parser):
+    parser.add_argument("--station", action="append", type=parse_station, default=[],
+                        metavar="NAME=BACKEND[:OPTIONS]",
+                        help="add a reader station; repeat for several readers "
+                             "(default: one station built from --reader)")
+    parser.add_argument("--reader", choices=["pn532", "sim"], default="pn532",
+                        help="tag reader backend (default: pn532)")
+    parser.add_argument("--trace", help="sim: replay 'seconds,uid' lines from this file")
+    parser.add_argument("--loop", action="store_true", help="sim: restart the trace when it ends")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="sim: random tag arrivals per second when no trace is given")
+    parser.add_argument("--new-fraction", type=float, default=0.05,
+                        help="sim: share of random arrivals that are unregistered tags")
+    parser.add_argument("--dwell", type=float, default=0,
+                        help="sim: seconds each tag stays on the pad after it arrives")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS, metavar="SECONDS",
+                        help=f"seconds a tag must go unread to count as removed (default: {DEBOUNCE_SECONDS})")
+    parser.add_argument("--history", type=int, default=DEBOUNCE_HISTORY,
+                        help=f"recent tags remembered per reader (default: {DEBOUNCE_HISTORY})")
+    parser.add_argument("--stats", type=float, default=0, metavar="SECONDS",
+                        help="print throughput every SECONDS")
+    parser.add_argument("--quiet", action="store_true", help="do not print every tag read")
+
+
+# Function to build the station list from parsed arguments
+def stations_from_args(args, parser):
+    stations = args.station or [("main", args.reader, {
+        "trace": args.trace, "loop": "1" if args.loop else "",
+        "rate": args.rate, "new": args.new_fraction, "dwell": args.dwell,
+    })]
+    names = [name for name, backend, options in stations]
+    if len(set(names)) != len(names):
+        parser.error("station names must be unique")
+    return stations
+
+
+# Function to start the scan-state worker and one polling thread per
+# station; returns the station threads
+def start_scanner(args, stations, store, channel):
+    # Scan state is handled on its own thread so the reader loops never wait
+    scan_state = ScanStateMachine(store, channel, verbose=not args.quiet)
+    threading.Thread(target=scan_state.run, daemon=True).start()
+
+    counter = {name: 0 for name, backend, options in stations}
+    threads = []
+    for name, backend, options in stations:
+        reader = create_reader(backend, options, store)
+        debouncer = TagDebouncer(args.debounce, args.history)
+        thread = threading.Thread(target=poll_station, name=f"station-{name}",
+                                  args=(name, reader, scan_state, counter, debouncer, args.quiet),
+                                  daemon=True)
+        threads.append(thread)
+
+    if args.stats:
+        threading.Thread(target=report_stats, args=(scan_state, counter, args.stats), daemon=True).start()
+
+    print(f"Waiting for an NFC card at {', '.join(counter)}...")
+    for thread in threads:
+        thread.start()
+    return scan_state, threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read NFC tags and publish scans to the sample store.")
+    add_scanner_arguments(parser)
+    args = parser.parse_args()
+    stations = stations_from_args(args, parser)
+
+    # Shared sample database
+    store = SampleStore()
+    scan_state, threads = start_scanner(args, stations, store, Channel(peer=WEB_SOCKET))
+
+    # The web app tells us when a new tag has been registered
+    def on_web_message(message):
+        if message.get("type") == "registered":
+            scan_state.registered(message.get("uid"))
+
+    Listener(SCANNER_SOCKET, on_web_message).ensure_started()
+
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
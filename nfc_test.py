@@ -1,23 +1,11 @@
 import os
-import board
-import busio
 import csv
 import datetime
 import time
-from adafruit_pn532.i2c import PN532_I2C
+from readers import PN532Reader
 
-# Initialize I2C interface
-i2c = busio.I2C(board.SCL, board.SDA)
-
-# Create an instance of the PN532 class
-pn532 = PN532_I2C(i2c, debug=False)
-
-# Get firmware version
-ic, ver, rev, support = pn532.firmware_version
-print(f"Found PN532 with firmware version: {ver}.{rev}")
-
-# Configure the reader
-pn532.SAM_configuration()
+# Initialize the NFC reader
+reader = PN532Reader()
 
 # File paths
 CHIP_DATA_FILE = "chip_data.csv"
@@ -94,9 +82,8 @@ print("Waiting for an NFC card...")
 
 # Main loop
 while True:
-    uid = pn532.read_passive_target(timeout=0.5)
-    if uid:
-        uid_hex = uid.hex()
+    uid_hex = reader.read(timeout=0.5)
+    if uid_hex:
         if uid_hex in known_chips:
             chip_data = known_chips[uid_hex]
             print(f"""
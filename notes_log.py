@@ -0,0 +1,144 @@
+import datetime
+import json
+import os
+import re
+import struct
+import tempfile
+from file_lock import FileLock
+
+# Each sample folder keeps its notes as one JSON record per line, plus an
+# index of the byte offset where every record starts, so the newest notes
+# (or any range of them) can be read without scanning the whole log
+NOTES_LOG = "notes.jsonl"
+NOTES_INDEX = "notes.idx"
+LEGACY_NOTES = "notes.txt"  # "[timestamp] text" lines written by older versions
+NOTE_FILES = (NOTES_LOG, NOTES_INDEX, LEGACY_NOTES)
+
+OFFSET = struct.Struct("<Q")
+LEGACY_LINE = re.compile(r"\[(.*?)\] ?(.*)")
+
+
+class NotesLog:
+    def __init__(self, sample_dir):
+        self.sample_dir = sample_dir
+        self.log_path = os.path.join(sample_dir, NOTES_LOG)
+        self.index_path = os.path.join(sample_dir, NOTES_INDEX)
+        if os.path.isdir(sample_dir):
+            # The folder lock keeps the web app, the integrated daemon and
+            # their threads from appending or repairing the log at once
+            with FileLock(sample_dir):
+                self._prepare()
+
+    # Migrate a legacy notes.txt on first use and repair an index left short
+    # by a crash between the log and index writes
+    def _prepare(self):
+        if not os.path.exists(self.log_path):
+            legacy = os.path.join(self.sample_dir, LEGACY_NOTES)
+            if not os.path.exists(legacy):
+                return
+            with open(legacy, "r", errors="replace") as f:
+                records = [_legacy_record(line) for line in f if line.strip()]
+            write_atomic(self.log_path, b"".join(_encode(record) for record in records))
+
+        if not self._index_matches():
+            self._rebuild_index()
+
+    # The index is current when its last offset points at the log's last line
+    def _index_matches(self):
+        log_size = os.path.getsize(self.log_path)
+        try:
+            index_size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return False
+        if index_size % OFFSET.size:
+            return False
+        if index_size == 0:
+            return log_size == 0
+        with open(self.index_path, "rb") as f:
+            f.seek(index_size - OFFSET.size)
+            last = OFFSET.unpack(f.read())[0]
+        with open(self.log_path, "rb") as f:
+            f.seek(last)
+            line = f.readline()
+            return line.endswith(b"\n") and f.tell() == log_size
+
+    def _rebuild_index(self):
+        offsets, position = [], 0
+        with open(self.log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn final write
+                offsets.append(position)
+                position += len(line)
+        with open(self.log_path, "r+b") as f:
+            f.truncate(position)
+        write_atomic(self.index_path, b"".join(OFFSET.pack(offset) for offset in offsets))
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.index_path) // OFFSET.size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, text, author="", timestamp=None):
+        record = {
+            "timestamp": timestamp or datetime.datetime.now().strftime("%B %d, %Y %I:%M %p"),
+            "author": author,
+            "text": text,
+        }
+        os.makedirs(self.sample_dir, exist_ok=True)
+        with FileLock(self.sample_dir):
+            with open(self.log_path, "ab") as f:
+                offset = f.tell()
+                f.write(_encode(record))
+            with open(self.index_path, "ab") as f:
+                f.write(OFFSET.pack(offset))
+        return record
+
+    # Records start..stop-1 in the order they were written
+    def records(self, start=0, stop=None):
+        if start >= len(self) or (stop is not None and stop <= start):
+            return []
+        with open(self.index_path, "rb") as f:
+            f.seek(start * OFFSET.size)
+            data = f.read() if stop is None else f.read((stop - start) * OFFSET.size)
+            end = f.read(OFFSET.size)
+        offsets = [offset for offset, in OFFSET.iter_unpack(data)]
+        with open(self.log_path, "rb") as f:
+            f.seek(offsets[0])
+            chunk = f.read(OFFSET.unpack(end)[0] - offsets[0]) if end else f.read()
+        return [json.loads(line) for line in chunk.splitlines()[:len(offsets)]]
+
+    # The newest `limit` notes before record number `before` (all when None),
+    # newest first with their record numbers, plus where the next page starts
+    def newest(self, limit, before=None):
+        stop = len(self) if before is None else min(before, len(self))
+        start = max(stop - limit, 0)
+        notes = [dict(record, n=n) for n, record in enumerate(self.records(start, stop), start)]
+        notes.reverse()
+        return notes, (start or None)
+
+
+def _encode(record):
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _legacy_record(line):
+    match = LEGACY_LINE.match(line.strip())
+    if match is None:
+        return {"timestamp": "", "author": "", "text": line.strip()}
+    return {"timestamp": match.group(1), "author": "", "text": match.group(2)}
+
+
+# Function to replace a file with `data` so readers see the old or new
+# contents in full, never a partial write. The temp file is a new hidden
+# file, so an attachment can never be the file being truncated.
+def write_atomic(path, data):
+    directory, name = os.path.split(path)
+    fd, temp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory or ".")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
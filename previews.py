@@ -0,0 +1,171 @@
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from blob_store import BLOB_DIR
+from notes_log import NOTE_FILES, write_atomic
+
+PREVIEW_DIR = ".previews"
+PREVIEW_WORKERS = 2
+THUMBNAIL_WIDTH = 200
+SNIPPET_LENGTH = 300
+
+
+# Function run in a worker process: write the PDF's text and a first-page
+# PNG next to each other under the hash they are cached by. Uses pypdf or
+# PyMuPDF when installed and poppler's pdftotext/pdftoppm otherwise; a
+# missing tool just means that part of the preview is left out.
+def render_preview(source, base):
+    text = _extract_text(source)
+    write_atomic(base + ".txt", (text or "").encode("utf-8"))
+    if _render_thumbnail(source, base + ".png.tmp"):
+        os.replace(base + ".png.tmp", base + ".png")
+    return text or ""
+
+
+def _extract_text(source):
+    try:
+        import pypdf
+    except ImportError:
+        pypdf = None
+    if pypdf is not None:
+        try:
+            return "\n".join(page.extract_text() or "" for page in pypdf.PdfReader(source).pages)
+        except Exception:
+            return None
+    if shutil.which("pdftotext"):
+        result = subprocess.run(["pdftotext", "-q", source, "-"], capture_output=True)
+        if result.returncode == 0:
+            return result.stdout.decode("utf-8", errors="replace")
+    return None
+
+
+def _render_thumbnail(source, target):
+    try:
+        import fitz
+    except ImportError:
+        fitz = None
+    if fitz is not None:
+        try:
+            with fitz.open(source) as document:
+                page = document[0]
+                zoom = THUMBNAIL_WIDTH / page.rect.width
+                page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).save(target, output="png")
+            return True
+        except Exception:
+            return False
+    if shutil.which("pdftoppm"):
+        prefix = target[:-len(".png.tmp")] + ".thumb"
+        result = subprocess.run(["pdftoppm", "-q", "-png", "-singlefile", "-f", "1", "-l", "1",
+                                 "-scale-to-x", str(THUMBNAIL_WIDTH), "-scale-to-y", "-1",
+                                 source, prefix], capture_output=True)
+        if result.returncode == 0 and os.path.exists(prefix + ".png"):
+            os.replace(prefix + ".png", target)
+            return True
+    return False
+
+
+# Text and first-page thumbnails for PDF attachments, made by a pool of
+# worker processes and cached on disk under samples/.previews by content
+# hash, so identical files are only processed once. `on_text(dr, text)` is
+# called for each extracted text so it can be searched.
+class PreviewPool:
+    def __init__(self, folder, hashes, on_text=None, workers=PREVIEW_WORKERS):
+        self.folder = folder
+        self.root = os.path.join(folder, PREVIEW_DIR)
+        self.hashes = hashes
+        self.on_text = on_text
+        # The workers are forked now, while the importing process has a
+        # single thread. Forking later from a request thread could copy a
+        # lock held by the watcher, the IPC listener or a reader station
+        # into a child that then waits on it forever. Forked rather than
+        # spawned so the workers do not re-import the web app.
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("fork"))
+        self._executor.submit(os.getpid)  # starts every worker
+        self._pending = {}  # digest -> DRs waiting on it
+        self._scanner = None
+        self._lock = threading.Lock()
+
+    def _base(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    # Function to queue a preview for one attachment; returns immediately
+    def submit(self, dr, path):
+        if self._executor is None or not path.lower().endswith(".pdf"):
+            return
+        digest = self.hashes.get(path)
+        base = self._base(digest)
+        if os.path.exists(base + ".txt"):
+            self._publish(dr, base)
+            return
+        with self._lock:
+            if digest in self._pending:
+                self._pending[digest].add(dr)
+                return
+            self._pending[digest] = {dr}
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        try:
+            future = self._executor.submit(render_preview, path, base)
+        except concurrent.futures.BrokenExecutor:
+            # A worker was killed (often out of memory on a large PDF). A new
+            # pool would have to fork from this now multi-threaded process,
+            # so previews stay off until restart; the upload itself is kept.
+            print("Preview workers have stopped; restart the app to make new previews.")
+            with self._lock:
+                self._executor = None
+                self._pending.clear()
+            return
+        future.add_done_callback(lambda future: self._finished(digest, future))
+
+    def _finished(self, digest, future):
+        with self._lock:
+            drs = self._pending.pop(digest, set())
+        if future.exception() is not None:
+            print(f"Could not preview {digest}: {future.exception()}")
+            return
+        for dr in drs:
+            self._publish(dr, self._base(digest))
+
+    def _publish(self, dr, base):
+        if self.on_text is None:
+            return
+        with open(base + ".txt", "r", encoding="utf-8", errors="replace") as f:
+            self.on_text(dr, f.read())
+
+    # Queue every PDF already in the sample folders (once, in a thread), so
+    # older attachments get previews and their cached text is searchable
+    def ensure_started(self):
+        with self._lock:
+            if self._scanner is None:
+                self._scanner = threading.Thread(target=self._scan, daemon=True)
+                self._scanner.start()
+
+    def _scan(self):
+        for dr in sorted(os.listdir(self.folder)):
+            sample_dir = os.path.join(self.folder, dr)
+            if dr in (BLOB_DIR, PREVIEW_DIR) or not os.path.isdir(sample_dir):
+                continue
+            for name in os.listdir(sample_dir):
+                if name not in NOTE_FILES:
+                    try:
+                        self.submit(dr, os.path.join(sample_dir, name))
+                    except OSError:
+                        pass
+
+    # Function to describe an attachment's cached preview, if it has one yet
+    def preview(self, path):
+        if not path.lower().endswith(".pdf"):
+            return None
+        base = self._base(self.hashes.get(path))
+        if not os.path.exists(base + ".txt"):
+            return {"pending": True, "snippet": "", "thumbnail": None}
+        with open(base + ".txt", "r", encoding="utf-8", errors="replace") as f:
+            snippet = " ".join(f.read(SNIPPET_LENGTH * 2).split())[:SNIPPET_LENGTH]
+        thumbnail = os.path.basename(base) + ".png" if os.path.exists(base + ".png") else None
+        return {"pending": False, "snippet": snippet, "thumbnail": thumbnail}
+
+    def thumbnail_path(self, name):
+        return self._base(name[:-len(".png")]) + ".png"
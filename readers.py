@@ -0,0 +1,109 @@
+import random
+import time
+
+
+# Tag reader backends. Every backend has read(timeout), which waits up to
+# `timeout` seconds for a tag and returns its UID as a hex string, or None.
+
+# The PN532 breakout on the Pi's I2C bus
+class PN532Reader:
+    def __init__(self, scl="SCL", sda="SDA"):
+        # Imported here so the rest of the pipeline runs on machines without
+        # the Blinka/CircuitPython libraries
+        import board
+        import busio
+        from adafruit_pn532.i2c import PN532_I2C
+
+        # Initialize I2C interface
+        i2c = busio.I2C(getattr(board, scl), getattr(board, sda))
+
+        # Create an instance of the PN532 class
+        self.pn532 = PN532_I2C(i2c, debug=False)
+
+        # Get firmware version
+        ic, ver, rev, support = self.pn532.firmware_version
+        print(f"Found PN532 with firmware version: {ver}.{rev}")
+
+        # Configure the reader
+        self.pn532.SAM_configuration()
+
+    def read(self, timeout):
+        uid = self.pn532.read_passive_target(timeout=timeout)
+        return uid.hex() if uid else None
+
+
+# Function to load a trace file of "seconds,uid" lines (blank lines and
+# lines starting with # are ignored)
+def load_trace(path):
+    trace = []
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            offset, uid = line.split(",", 1)
+            trace.append((float(offset), uid.strip().lower()))
+    trace.sort()
+    return trace
+
+
+# Stand-in for the PN532 that replays a trace, or produces random tag
+# arrivals at `rate` per second drawn from `uids` plus a share of new tags.
+# With `dwell`, each tag keeps being read for that many seconds, like a tag
+# left resting on the pad.
+class SimulatedReader:
+    def __init__(self, trace=None, rate=1.0, uids=(), new_fraction=0.05, loop=False, seed=None, dwell=0):
+        self.trace = trace
+        self.rate = rate
+        self.uids = list(uids)
+        self.new_fraction = new_fraction
+        self.loop = loop
+        self.dwell = dwell
+        self._resting = None  # (uid, time it leaves the pad)
+        self.random = random.Random(seed)
+        self.reads = 0
+        self._start = time.monotonic()
+        self._index = 0
+        self._next = self._schedule(self._start)
+
+    def _schedule(self, now):
+        if self.trace is not None:
+            if self._index >= len(self.trace):
+                if not self.loop or not self.trace:
+                    return None
+                self._index = 0
+                self._start = now - self.trace[0][0]
+            offset, uid = self.trace[self._index]
+            self._index += 1
+            return self._start + offset, uid
+
+        if self.uids and self.random.random() >= self.new_fraction:
+            uid = self.random.choice(self.uids)
+        else:
+            uid = "04" + self.random.getrandbits(48).to_bytes(6, "big").hex()  # 7-byte NXP-style UID
+        return now + self.random.expovariate(self.rate), uid
+
+    def read(self, timeout):
+        if self._resting is not None:
+            uid, leaves = self._resting
+            if time.monotonic() < leaves and (self._next is None or time.monotonic() < self._next[0]):
+                time.sleep(min(timeout, 0.02))  # roughly one PN532 read cycle
+                self.reads += 1
+                return uid
+            self._resting = None
+
+        if self._next is None:
+            time.sleep(timeout)  # trace finished: behave like an empty reader
+            return None
+        due, uid = self._next
+        wait = due - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return None
+        if wait > 0:
+            time.sleep(wait)
+        self._next = self._schedule(due)
+        if self.dwell:
+            self._resting = (uid, due + self.dwell)
+        self.reads += 1
+        return uid
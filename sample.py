@@ -0,0 +1,78 @@
+import enum
+import sys
+from sample_store import SAMPLE_FIELDS, parse_dr
+
+
+# Workflow states offered on the dashboard
+class Status(str, enum.Enum):
+    RECEIVED = "Received"
+    IN_PROGRESS = "In Progress"
+    ON_HOLD = "On Hold"
+    REPORT = "Report"
+    COMPLETE = "Complete"
+
+    # Function to turn stored text into a Status; any other text (older or
+    # hand-edited rows) is kept as an interned string rather than rejected.
+    # A missing status becomes "", never None, which would mean archived.
+    @classmethod
+    def parse(cls, text):
+        if text is None:
+            return ""
+        try:
+            return cls(text)
+        except ValueError:
+            return sys.intern(text) if isinstance(text, str) else text
+
+
+# Fields shared by many samples; interning keeps one copy of each value
+INTERNED_FIELDS = ("FID", "PID", "SB", "TB", "TR")
+
+
+# One sample held in memory. Slots instead of a per-row dict, repeated
+# strings interned, DR parsed once into `received` (None if it does not
+# parse) and the status as a Status. DR itself is kept verbatim because it
+# names the sample's folder. Rows read like the dicts they replace, so
+# sample["PID"] works, and to_row() gives the dict the JSON APIs send.
+class Sample:
+    __slots__ = ("ID", "UID", "FID", "PID", "SB", "TB", "TR", "DR", "received", "status")
+
+    def __init__(self, ID, UID, FID, PID, SB, TB, TR, DR, status=None):
+        self.ID = ID
+        self.UID = UID
+        self.FID = sys.intern(FID)
+        self.PID = sys.intern(PID)
+        self.SB = sys.intern(SB)
+        self.TB = sys.intern(TB)
+        self.TR = sys.intern(TR)
+        self.DR = DR
+        self.received = parse_dr(DR)
+        self.status = None if status is None else Status.parse(status)
+
+    # Archived rows have no Status column, so their status stays None
+    @classmethod
+    def from_row(cls, row):
+        return cls(*(row.get(field) or "" for field in SAMPLE_FIELDS), status=row.get("Status"))
+
+    @property
+    def active(self):
+        return self.status is not None
+
+    def __getitem__(self, field):
+        if field == "Status":
+            return _status_text(self.status)
+        if field in SAMPLE_FIELDS:
+            return getattr(self, field)
+        raise KeyError(field)
+
+    def to_row(self):
+        row = {field: getattr(self, field) for field in SAMPLE_FIELDS}
+        if self.status is not None:
+            row["Status"] = _status_text(self.status)
+        return row
+
+    def __repr__(self):
+        return f"Sample({self.UID!r}, {self.ID!r}, {self.DR!r}, {self.status!r})"
+
+
+def _status_text(status):
+    return status.value if isinstance(status, Status) else status
@@ -0,0 +1,77 @@
+import threading
+from sample import Sample
+
+
+# In-memory lookup of active and archived samples by UID, by DR (the name of
+# the sample's folder under samples/) and by sample ID. It follows the store's
+# chip_data change log, so once built a lookup costs one log query and only
+# the samples that changed since the last lookup are read again.
+class SampleIndex:
+    def __init__(self, store):
+        self.store = store
+        self._position = None
+        self._by_uid = {}  # UID -> every sample for that tag, active then newest
+        self._by_dr = {}
+        self._by_id = {}   # ID -> samples, since IDs are not unique
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        # Read the log position first so changes made meanwhile are replayed
+        self._position = self.store.chip_log_position()
+        self._by_uid, self._by_dr, self._by_id = {}, {}, {}
+        samples = {}
+        for row in self.store.active_samples() + self.store.archived_samples()[::-1]:
+            samples.setdefault(row["UID"], []).append(Sample.from_row(row))
+        for uid, rows in samples.items():
+            self._add(uid, rows)
+
+    def _add(self, uid, rows):
+        self._by_uid[uid] = rows
+        for row in reversed(rows):  # the active sample wins a shared DR
+            self._by_dr[row["DR"]] = row
+            self._by_id.setdefault(row["ID"], []).append(row)
+
+    def _remove(self, uid):
+        for row in self._by_uid.pop(uid, []):
+            if self._by_dr.get(row["DR"]) is row:
+                del self._by_dr[row["DR"]]
+            same_id = [other for other in self._by_id.get(row["ID"], []) if other is not row]
+            if same_id:
+                self._by_id[row["ID"]] = same_id
+            else:
+                self._by_id.pop(row["ID"], None)
+
+    def _refresh(self):
+        if self._position is None:
+            self._rebuild()
+            return
+        latest, uids = self.store.chip_changes(self._position)
+        if uids is None:
+            self._rebuild()
+            return
+        for uid in uids:
+            self._remove(uid)
+            rows = [Sample.from_row(row) for row in self.store.samples_for_uid(uid)]
+            if rows:
+                self._add(uid, rows)
+        self._position = latest
+
+    # Function to find the current (or else most recent) sample for a tag
+    def by_uid(self, uid):
+        with self._lock:
+            self._refresh()
+            rows = self._by_uid.get(uid)
+            return rows[0].to_row() if rows else None
+
+    # Function to find a sample by its DR folder key
+    def by_dr(self, dr):
+        with self._lock:
+            self._refresh()
+            row = self._by_dr.get(dr)
+            return row.to_row() if row else None
+
+    # Function to list every sample with the given ID
+    def by_id(self, sample_id):
+        with self._lock:
+            self._refresh()
+            return [row.to_row() for row in self._by_id.get(sample_id, [])]
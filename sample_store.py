@@ -0,0 +1,613 @@
+import os
+import csv
+import datetime
+import functools
+import sqlite3
+import sys
+import threading
+from snapshot_cache import file_signature
+
+# Path to the database shared by app.py and nfc_scanner.py
+DB_FILE = "samples.db"
+
+# Legacy CSV files, only read by the one-shot migration
+CHIP_DATA_FILE = "chip_data.csv"
+ARCHIVED_FILE = "archived.csv"
+SCAN_STATUS_FILE = "scan_status.csv"
+
+SAMPLE_FIELDS = ["ID", "UID", "FID", "PID", "SB", "TB", "TR", "DR"]
+CHIP_FIELDS = SAMPLE_FIELDS + ["Status"]
+
+# DR formats written by app.py and by the older scanner scripts
+DR_FORMATS = ("%B %d, %Y %I:%M %p", "%Y-%m-%d %H:%M:%S")
+# Sortable form of DR kept in received_at ("" when DR does not parse)
+RECEIVED_FORMAT = "%Y-%m-%dT%H:%M"
+
+# Archive sort keys accepted by query_archived, and the column behind each
+ARCHIVE_SORTS = {"dr": "received_at", "id": "ID", "pid": "PID", "uid": "UID", "archived": "seq"}
+
+# Archived samples are split into one table per month of DR, named
+# archived_YYYYMM, plus archived_undated for DR values that do not parse
+ARCHIVE_PARTITION_PREFIX = "archived_"
+UNDATED_PARTITION = "archived_undated"
+
+# Stored as user_version; databases below it are upgraded when opened
+SCHEMA_VERSION = 5
+
+# Entries kept in chip_data_log; readers further behind than this reload fully
+CHIP_LOG_LENGTH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chip_data (
+    ID TEXT, UID TEXT NOT NULL, FID TEXT, PID TEXT, SB TEXT, TB TEXT, TR TEXT, DR TEXT, Status TEXT,
+    received_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS chip_data_uid ON chip_data(UID);
+CREATE INDEX IF NOT EXISTS chip_data_dr ON chip_data(DR);
+CREATE INDEX IF NOT EXISTS chip_data_status ON chip_data(Status);
+
+-- Sidecar index of every archived sample: seq is the global archive order
+-- and doubles as the row key inside the sample's month partition
+CREATE TABLE IF NOT EXISTS archive_index (
+    seq INTEGER PRIMARY KEY,
+    UID TEXT NOT NULL,
+    DR TEXT,
+    partition TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archive_index_uid ON archive_index(UID);
+CREATE INDEX IF NOT EXISTS archive_index_dr ON archive_index(DR);
+
+CREATE TABLE IF NOT EXISTS scan_status (
+    uid TEXT PRIMARY KEY,
+    web_scan INTEGER NOT NULL DEFAULT 0,
+    host_scan INTEGER NOT NULL DEFAULT 0,
+    new INTEGER NOT NULL DEFAULT 0,
+    station TEXT
+);
+
+-- UIDs of changed chip_data rows, so readers can reload only what changed
+CREATE TABLE IF NOT EXISTS chip_data_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS chip_data_log_insert AFTER INSERT ON chip_data BEGIN
+    INSERT INTO chip_data_log (uid) VALUES (new.UID);
+    DELETE FROM chip_data_log WHERE seq <= (SELECT MAX(seq) FROM chip_data_log) - {log_length};
+END;
+CREATE TRIGGER IF NOT EXISTS chip_data_log_update AFTER UPDATE ON chip_data BEGIN
+    INSERT INTO chip_data_log (uid) VALUES (new.UID);
+    DELETE FROM chip_data_log WHERE seq <= (SELECT MAX(seq) FROM chip_data_log) - {log_length};
+END;
+CREATE TRIGGER IF NOT EXISTS chip_data_log_delete AFTER DELETE ON chip_data BEGIN
+    INSERT INTO chip_data_log (uid) VALUES (old.UID);
+    DELETE FROM chip_data_log WHERE seq <= (SELECT MAX(seq) FROM chip_data_log) - {log_length};
+END;
+""".format(log_length=CHIP_LOG_LENGTH)
+
+SCAN_FLAGS = ("web_scan", "host_scan", "new")
+SCAN_FIELDS = SCAN_FLAGS + ("station",)  # station: reader that last saw the tag
+
+
+# Group commit: writes from threads that arrive while another thread is
+# committing are queued, and the next thread to lead runs the whole queue
+# in one transaction, so a burst from the scanner, browsers and timers costs
+# one BEGIN/COMMIT instead of one each. Every write gets its own savepoint,
+# so one failing write is rolled back and raised to its caller alone.
+class _GroupCommit:
+    def __init__(self, store):
+        self.store = store
+        self._queue = []
+        self._leading = False
+        self._lock = threading.Lock()
+
+    def run(self, operation):
+        write = _QueuedWrite(operation)
+        with self._lock:
+            self._queue.append(write)
+            lead = not self._leading
+            self._leading = True
+        if lead:
+            self._lead()
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _lead(self):
+        while True:
+            with self._lock:
+                batch, self._queue = self._queue, []
+                if not batch:
+                    self._leading = False
+                    return
+            self._commit(batch)
+
+    def _commit(self, batch):
+        local = self.store._local
+        try:
+            with self.store.transaction() as conn:
+                for write in batch:
+                    conn.execute("SAVEPOINT queued_write")
+                    try:
+                        write.result = write.operation()
+                    except Exception as error:
+                        conn.execute("ROLLBACK TO queued_write")
+                        local.failed = False  # only this write is undone
+                        write.error = error
+                    conn.execute("RELEASE queued_write")
+        except Exception as error:
+            for write in batch:
+                write.error = write.error or error
+        finally:
+            for write in batch:
+                write.done.set()
+
+
+class _QueuedWrite:
+    __slots__ = ("operation", "result", "error", "done")
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# Decorator routing a store write through group commit, unless the calling
+# thread is already inside a transaction and the write simply joins it
+def _group_committed(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self._local, "depth", 0):
+            return method(self, *args, **kwargs)
+        return self._group.run(lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+# Sample and scan state backed by SQLite in WAL mode, so the web app and the
+# scanner can read while the other one writes, and every change touches only
+# the affected row instead of rewriting a whole CSV file.
+class SampleStore:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.generation = 0  # Bumped on every commit made by this process
+        self._local = threading.local()
+        self._group = _GroupCommit(self)
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._upgrade(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # Bring databases created by older versions up to the current schema
+    def _upgrade(self, conn):
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(scan_status)")}
+        if "station" not in columns:
+            conn.execute("ALTER TABLE scan_status ADD COLUMN station TEXT")
+
+        # Sortable copy of DR for date-range queries and cursor pagination
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(chip_data)")}
+        if "received_at" not in columns:
+            conn.execute("ALTER TABLE chip_data ADD COLUMN received_at TEXT")
+            rows = conn.execute("SELECT rowid, DR FROM chip_data").fetchall()
+            conn.executemany("UPDATE chip_data SET received_at = ? WHERE rowid = ?",
+                             [(received_at(row["DR"]), row["rowid"]) for row in rows])
+
+        with self.transaction() as conn:
+            # Split the single archived table of older versions into partitions
+            kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'archived'").fetchone()
+            legacy = kind is not None and kind["type"] == "table"
+            if legacy:
+                conn.execute("ALTER TABLE archived RENAME TO archived_legacy")
+            self._ensure_partition(conn, UNDATED_PARTITION)
+            if legacy:
+                for row in conn.execute("SELECT * FROM archived_legacy ORDER BY rowid").fetchall():
+                    row = dict(row)
+                    row["received_at"] = row.get("received_at") or received_at(row["DR"])
+                    self._insert_archived(conn, row)
+                conn.execute("DROP TABLE archived_legacy")
+
+    # --- Archive partitions ---
+
+    # Partition names in chronological order, undated first, optionally
+    # limited to the months overlapping a start/end received_at range
+    def _partitions(self, conn, start=None, end=None):
+        names = [row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                 if row["name"] == UNDATED_PARTITION
+                 or (row["name"].startswith(ARCHIVE_PARTITION_PREFIX)
+                     and row["name"][len(ARCHIVE_PARTITION_PREFIX):].isdigit())]
+        names.sort(key=_partition_month)
+        if start or end:
+            names = [name for name in names if name != UNDATED_PARTITION
+                     and (not start or _partition_month(name) >= start[:7])
+                     and (not end or _partition_month(name) <= end[:7])]
+        return names
+
+    # Create a partition (and rebuild the archived view) if it is missing
+    def _ensure_partition(self, conn, name):
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (name,)).fetchone()
+        if exists:
+            return name
+        conn.execute(
+            f"CREATE TABLE {name} (seq INTEGER PRIMARY KEY, ID TEXT, UID TEXT NOT NULL, FID TEXT, "
+            f"PID TEXT, SB TEXT, TB TEXT, TR TEXT, DR TEXT, received_at TEXT)")
+        conn.execute(f"CREATE INDEX {name}_received_at ON {name}(received_at)")
+        conn.execute(f"CREATE INDEX {name}_pid ON {name}(PID, received_at)")
+        self._refresh_archive_view(conn)
+        return name
+
+    # The archived view reads every partition, for queries not bound to a date
+    def _refresh_archive_view(self, conn):
+        selects = " UNION ALL ".join(
+            f"SELECT seq, {', '.join(SAMPLE_FIELDS)}, received_at FROM {name}"
+            for name in self._partitions(conn))
+        conn.execute("DROP VIEW IF EXISTS archived")
+        conn.execute(f"CREATE VIEW archived AS {selects}")
+
+    def _insert_archived(self, conn, row):
+        partition = self._ensure_partition(conn, partition_name(row["received_at"]))
+        seq = conn.execute("INSERT INTO archive_index (UID, DR, partition) VALUES (?, ?, ?)",
+                           (row["UID"], row["DR"], partition)).lastrowid
+        conn.execute(
+            f"INSERT INTO {partition} (seq, ID, UID, FID, PID, SB, TB, TR, DR, received_at) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [seq] + [row.get(field, "") for field in SAMPLE_FIELDS] + [row["received_at"]])
+        return seq
+
+    # Fetch one archived row through the sidecar index
+    def _archived_row(self, conn, column, value):
+        entry = conn.execute(f"SELECT seq, partition FROM archive_index WHERE {column} = ? LIMIT 1",
+                             (value,)).fetchone()
+        if entry is None:
+            return None
+        return conn.execute(
+            f"SELECT {', '.join(SAMPLE_FIELDS)} FROM {entry['partition']} WHERE seq = ?",
+            (entry["seq"],)).fetchone()
+
+    # One connection per thread, since Flask serves requests from several threads
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self)
+
+    # Changes whenever this process commits or another process writes the
+    # database or its write-ahead log
+    def signature(self):
+        return self.generation, file_signature([self.path, self.path + "-wal"])
+
+    # --- Samples ---
+
+    def active_samples(self):
+        rows = self.connection().execute(
+            "SELECT ID, UID, FID, PID, SB, TB, TR, DR, Status FROM chip_data ORDER BY rowid")
+        return [dict(row) for row in rows]
+
+    def archived_samples(self):
+        rows = self.connection().execute(
+            "SELECT ID, UID, FID, PID, SB, TB, TR, DR FROM archived ORDER BY seq")
+        return [dict(row) for row in rows]
+
+    def get_active(self, uid):
+        row = self.connection().execute(
+            "SELECT ID, UID, FID, PID, SB, TB, TR, DR, Status FROM chip_data WHERE UID = ?",
+            (uid,)).fetchone()
+        return dict(row) if row else None
+
+    # Look up a sample (active first, then archived) by its DR directory key
+    def find_by_dr(self, dr):
+        conn = self.connection()
+        row = conn.execute(
+            "SELECT ID, UID, FID, PID, SB, TB, TR, DR, Status FROM chip_data WHERE DR = ?",
+            (dr,)).fetchone()
+        if row is None:
+            row = self._archived_row(conn, "DR", dr)
+        return dict(row) if row else None
+
+    # Every sample recorded for a tag: the active one, then archived newest first
+    def samples_for_uid(self, uid):
+        conn = self.connection()
+        rows = [dict(row) for row in conn.execute(
+            "SELECT ID, UID, FID, PID, SB, TB, TR, DR, Status FROM chip_data WHERE UID = ?", (uid,))]
+        entries = conn.execute("SELECT seq, partition FROM archive_index WHERE UID = ? ORDER BY seq DESC",
+                               (uid,)).fetchall()
+        for entry in entries:
+            row = conn.execute(
+                f"SELECT {', '.join(SAMPLE_FIELDS)} FROM {entry['partition']} WHERE seq = ?",
+                (entry["seq"],)).fetchone()
+            rows.append(dict(row))
+        return rows
+
+    # (uid, archived, locator) for every tag ever registered, or only for the
+    # given UIDs: the chip_data rowid of an active sample, otherwise the seq
+    # of its latest archived sample. Active entries come last.
+    def uid_locations(self, uids=None):
+        conn = self.connection()
+        where, params = "", []
+        if uids is not None:
+            params = list(uids)
+            if not params:
+                return []
+            where = f" WHERE UID IN ({', '.join('?' * len(params))})"
+        rows = [(row["UID"], True, row["seq"]) for row in conn.execute(
+            f"SELECT UID, MAX(seq) AS seq FROM archive_index{where} GROUP BY UID", params)]
+        rows += [(row["UID"], False, row["rowid"]) for row in conn.execute(
+            f"SELECT UID, rowid FROM chip_data{where}", params)]
+        return rows
+
+    # Return (latest log position, UIDs changed since `since`), with None in
+    # place of the UIDs when the log no longer reaches back that far
+    def chip_changes(self, since):
+        conn = self.connection()
+        oldest = conn.execute("SELECT MIN(seq) FROM chip_data_log").fetchone()[0]
+        rows = conn.execute("SELECT seq, uid FROM chip_data_log WHERE seq > ?", (since,)).fetchall()
+        latest = max((row["seq"] for row in rows), default=since)
+        if oldest is not None and since + 1 < oldest:
+            return latest, None
+        return latest, {row["uid"] for row in rows}
+
+    def chip_log_position(self):
+        return self.connection().execute("SELECT COALESCE(MAX(seq), 0) FROM chip_data_log").fetchone()[0]
+
+    # Return one page of archived samples, newest first by default, plus the
+    # `after` value for the next page (None on the last page). `filters` may
+    # hold PID, SB and TB (matched case-insensitively) and a start/end
+    # received_at range (end exclusive).
+    def query_archived(self, filters=None, sort="dr", descending=True, limit=50, after=None):
+        filters = filters or {}
+        column = ARCHIVE_SORTS[sort]
+        clauses, params = [], []
+        for field in ("PID", "SB", "TB"):
+            if filters.get(field):
+                clauses.append(f"{field} = ? COLLATE NOCASE")
+                params.append(filters[field])
+        if filters.get("start"):
+            clauses.append("received_at >= ?")
+            params.append(filters["start"])
+        if filters.get("end"):
+            clauses.append("received_at < ?")
+            params.append(filters["end"])
+
+        # Keyset pagination: continue strictly after the last row served
+        op, order = ("<", "DESC") if descending else (">", "ASC")
+        if after is not None:
+            value, seq = after
+            clauses.append(f"({column} {op} ? OR ({column} = ? AND seq {op} ?))")
+            params.extend([value, value, seq])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        select = (f"SELECT seq, ID, UID, FID, PID, SB, TB, TR, DR, received_at FROM {{table}} "
+                  f"{where} ORDER BY {column} {order}, seq {order} LIMIT ?")
+        conn = self.connection()
+        partitions = self._partitions(conn, filters.get("start"), filters.get("end"))
+
+        rows = []
+        if sort == "dr":
+            # Partitions are disjoint months, so walking them in order and
+            # stopping once the page is full touches only the months needed
+            for partition in reversed(partitions) if descending else partitions:
+                rows += conn.execute(select.format(table=partition), params + [limit + 1 - len(rows)]).fetchall()
+                if len(rows) > limit:
+                    break
+        elif partitions:
+            union = " UNION ALL ".join(f"SELECT * FROM {partition}" for partition in partitions)
+            rows = conn.execute(select.format(table=f"({union})"), params + [limit + 1]).fetchall()
+
+        page = [{field: row[field] for field in SAMPLE_FIELDS} for row in rows[:limit]]
+        next_after = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_after = (last[column], last["seq"])
+        return page, next_after
+
+    @_group_committed
+    def add_sample(self, entry):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO chip_data (ID, UID, FID, PID, SB, TB, TR, DR, Status, received_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [entry.get(field, "") for field in CHIP_FIELDS] + [received_at(entry.get("DR"))])
+
+    @_group_committed
+    def update_status(self, uid, status):
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE chip_data SET Status = ? WHERE UID = ?", (status, uid))
+        return cursor.rowcount > 0
+
+    # Move a sample from the active table to its archive partition in one transaction
+    @_group_committed
+    def archive(self, uid):
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT ID, UID, FID, PID, SB, TB, TR, DR, received_at FROM chip_data WHERE UID = ?",
+                (uid,)).fetchone()
+            if row is None:
+                return False
+            self._insert_archived(conn, dict(row))
+            conn.execute("DELETE FROM chip_data WHERE UID = ?", (uid,))
+            conn.execute("DELETE FROM scan_status WHERE uid = ?", (uid,))
+        return True
+
+    # Batch versions of update_status and archive: one transaction and one
+    # commit for the whole batch; return {uid: whether it was changed}
+    @_group_committed
+    def update_statuses(self, changes):
+        with self.transaction():
+            return {uid: self.update_status(uid, status) for uid, status in changes.items()}
+
+    @_group_committed
+    def archive_many(self, uids):
+        with self.transaction():
+            return {uid: self.archive(uid) for uid in uids}
+
+    # --- Scan status ---
+
+    def scan_status(self):
+        rows = self.connection().execute("SELECT uid, web_scan, host_scan, new, station FROM scan_status")
+        return {row["uid"]: _scan_row(row) for row in rows}
+
+    def get_scan_status(self, uid):
+        row = self.connection().execute(
+            "SELECT uid, web_scan, host_scan, new, station FROM scan_status WHERE uid = ?",
+            (uid,)).fetchone()
+        return _scan_row(row) if row else None
+
+    def set_scan_status(self, uid, **fields):
+        self.set_scan_statuses({uid: fields})
+
+    # Apply {uid: {field: value}} in one transaction, touching only the given fields
+    @_group_committed
+    def set_scan_statuses(self, changes):
+        with self.transaction() as conn:
+            for uid, fields in changes.items():
+                unknown = set(fields) - set(SCAN_FIELDS)
+                if unknown:
+                    raise ValueError(f"Unknown scan status fields: {', '.join(sorted(unknown))}")
+                values = {field: 0 for field in SCAN_FLAGS}
+                values["station"] = None
+                for field, value in fields.items():
+                    values[field] = value if field == "station" else int(bool(value))
+                assignments = ", ".join(f"{field} = excluded.{field}" for field in fields) or "uid = uid"
+                conn.execute(
+                    "INSERT INTO scan_status (uid, web_scan, host_scan, new, station) VALUES (?, ?, ?, ?, ?) "
+                    f"ON CONFLICT(uid) DO UPDATE SET {assignments}",
+                    (uid, values["web_scan"], values["host_scan"], values["new"], values["station"]))
+
+    def new_scan_uid(self):
+        row = self.connection().execute("SELECT uid FROM scan_status WHERE new = 1 LIMIT 1").fetchone()
+        return row["uid"] if row else None
+
+    # Give every active sample a scan status row and drop rows for samples that
+    # are gone, keeping any tag that is still waiting to be registered or is
+    # still highlighted (an archived sample's tag)
+    @_group_committed
+    def sync_scan_status(self):
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO scan_status (uid) SELECT UID FROM chip_data")
+            conn.execute(
+                "DELETE FROM scan_status WHERE new = 0 AND host_scan = 0 "
+                "AND uid NOT IN (SELECT UID FROM chip_data)")
+
+
+# Write transaction; nested uses join the outermost one, so several store
+# calls can be grouped into a single commit
+class _Transaction:
+    def __init__(self, store):
+        self.store = store
+        self.conn = store.connection()
+        self.local = store._local
+
+    def __enter__(self):
+        depth = getattr(self.local, "depth", 0)
+        if depth == 0:
+            self.conn.execute("BEGIN IMMEDIATE")
+        self.local.depth = depth + 1
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.local.depth -= 1
+        if exc_type is not None:
+            self.local.failed = True
+        if self.local.depth > 0:
+            return False
+        if getattr(self.local, "failed", False):
+            self.local.failed = False
+            self.conn.execute("ROLLBACK")
+        else:
+            self.conn.execute("COMMIT")
+            self.store.generation += 1
+        return False
+
+
+# Function to parse a DR value; None if it is in no known format
+def parse_dr(dr):
+    for fmt in DR_FORMATS:
+        try:
+            return datetime.datetime.strptime(dr, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+# Function to turn a DR value into a sortable "YYYY-MM-DDTHH:MM" string
+def received_at(dr):
+    parsed = parse_dr(dr)
+    return parsed.strftime(RECEIVED_FORMAT) if parsed else ""
+
+
+# Function to name the archive partition for a received_at value
+def partition_name(received):
+    if not received:
+        return UNDATED_PARTITION
+    return ARCHIVE_PARTITION_PREFIX + received[:7].replace("-", "")
+
+
+# Function to give a partition's "YYYY-MM" month ("" when undated)
+def _partition_month(name):
+    if name == UNDATED_PARTITION:
+        return ""
+    month = name[len(ARCHIVE_PARTITION_PREFIX):]
+    return f"{month[:4]}-{month[4:]}"
+
+
+def _scan_row(row):
+    status = {field: bool(row[field]) for field in SCAN_FLAGS}
+    status["station"] = row["station"]
+    return status
+
+
+def _read_csv(path):
+    if not os.path.exists(path) or os.stat(path).st_size == 0:
+        return []
+    with open(path, "r", newline="") as file:
+        return list(csv.DictReader(file))
+
+
+# One-shot import of chip_data.csv, archived.csv and scan_status.csv
+def migrate_from_csv(store, chip_data_file=CHIP_DATA_FILE, archived_file=ARCHIVED_FILE,
+                     scan_status_file=SCAN_STATUS_FILE):
+    conn = store.connection()
+    existing = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM chip_data) + (SELECT COUNT(*) FROM archive_index)").fetchone()[0]
+    if existing:
+        raise RuntimeError(f"{store.path} already holds samples; refusing to migrate twice.")
+
+    chip_rows = _read_csv(chip_data_file)
+    archived_rows = _read_csv(archived_file)
+    scan_rows = _read_csv(scan_status_file)
+
+    with store.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO chip_data (ID, UID, FID, PID, SB, TB, TR, DR, Status, received_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [[row.get(field, "") for field in CHIP_FIELDS] + [received_at(row.get("DR"))]
+             for row in chip_rows])
+        for row in archived_rows:
+            store._insert_archived(conn, dict(row, received_at=received_at(row.get("DR"))))
+        conn.executemany(
+            "INSERT OR REPLACE INTO scan_status (uid, web_scan, host_scan, new) VALUES (?, ?, ?, ?)",
+            [(row["Sample UID"], row["Web scan"] == "True", row["Host scan"] == "True",
+              row.get("new") == "True") for row in scan_rows])
+
+    return len(chip_rows), len(archived_rows), len(scan_rows)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("Usage: python sample_store.py migrate")
+        sys.exit(1)
+    try:
+        active, archived, scans = migrate_from_csv(SampleStore())
+    except RuntimeError as error:
+        print(error)
+        sys.exit(1)
+    print(f"Migrated {active} active samples, {archived} archived samples and {scans} scan status rows into {DB_FILE}.")
@@ -0,0 +1,262 @@
+import collections
+import queue
+import threading
+import time
+from sample import Sample
+from sample_store import SCAN_FLAGS
+from scheduler import Scheduler
+from uid_index import UidIndex
+
+# Seconds a recognized tag stays highlighted on the dashboard
+HOST_SCAN_SECONDS = 3
+
+# Seconds a new tag waits for its registration form before it is dropped
+PENDING_NEW_SECONDS = 15 * 60
+
+# Seconds within which reads of the same tag, from any station, count as one scan
+DEDUP_SECONDS = 1.0
+
+# Seconds a tag must go unread before it counts as removed from a reader
+DEBOUNCE_SECONDS = 1.0
+
+# Tags each reader remembers at once for debouncing
+DEBOUNCE_HISTORY = 16
+
+# Seconds between store checks for pending tags, in case the web app was
+# restarted and its "registered" message never arrived
+REGISTRATION_RECHECK = 5
+
+
+# Function to print a recognized chip the way the scanner always has
+def print_chip(chip_data, station=None):
+    print(f"""
+Recognized Chip{f' at {station}' if station else ''}:
+    Sample ID: {chip_data['ID']}
+    UID: {chip_data['UID']}
+    Field #: {chip_data['FID']}
+    Project #: {chip_data['PID']}
+    Sampled By: {chip_data['SB']}
+    Tested By: {chip_data['TB']}
+    Tests Run: {chip_data['TR']}
+    Date Received: {chip_data['DR']}
+            """)
+
+
+# In-memory copy of the scan status table. Changes are only recorded when a
+# value actually differs, and dirty fields are written back in one
+# transaction per flush instead of one write per transition.
+class ScanStatusBuffer:
+    def __init__(self, store):
+        self.store = store
+        self.rows = store.scan_status()
+        self.dirty = {}
+
+    def set(self, uid, **fields):
+        row = self.rows.setdefault(uid, dict({field: False for field in SCAN_FLAGS}, station=None))
+        for field, value in fields.items():
+            if row[field] != value:
+                row[field] = value
+                self.dirty.setdefault(uid, {})[field] = value
+
+    def flush(self):
+        if not self.dirty:
+            return False
+        self.store.set_scan_statuses(self.dirty)
+        self.dirty = {}
+        return True
+
+
+ScanEvent = collections.namedtuple("ScanEvent", "kind uid station")
+
+
+# Per-reader presence tracking. A tag resting on the pad is returned on every
+# read; only its arrival and its removal are reported. Recently seen tags are
+# kept in a small ring buffer of [uid, last_seen] entries, newest last.
+class TagDebouncer:
+    def __init__(self, removal_seconds=DEBOUNCE_SECONDS, history=DEBOUNCE_HISTORY):
+        self.removal_seconds = removal_seconds
+        self.recent = collections.deque(maxlen=history)
+
+    # Feed the result of one read (a UID or None); returns a list of
+    # ("arrived", uid) and ("removed", uid) transitions
+    def update(self, uid, now=None):
+        now = time.monotonic() if now is None else now
+        transitions = []
+        for entry in list(self.recent):
+            if entry[0] != uid and now - entry[1] >= self.removal_seconds:
+                self.recent.remove(entry)
+                transitions.append(("removed", entry[0]))
+
+        if uid:
+            for entry in self.recent:
+                if entry[0] == uid:
+                    entry[1] = now
+                    break
+            else:
+                self.recent.append([uid, now])
+                transitions.append(("arrived", uid))
+        return transitions
+
+
+# Scan-state processing, split from the reader loop. The reader only queues
+# tag reads; this worker owns every delayed transition (host-scan highlight
+# expiry, pending-registration timeout, registration recheck) on one
+# scheduler, so neither the reader nor any timer thread ever sleeps.
+class ScanStateMachine:
+    def __init__(self, store, channel, verbose=True):
+        self.store = store
+        self.verbose = verbose
+        self.processed = 0  # tag events handled, for throughput reporting
+        self.channel = channel  # notifies the web app after each flush
+        self.events = queue.Queue()
+        self.known_chips = {}  # full rows of active samples, for printing
+        self.uid_index = UidIndex()  # every UID ever registered, active or archived
+        self.chip_seq = 0  # position in the store's chip_data change log
+        self.scan_status = None
+        self.timers = Scheduler()
+        self.pending = set()  # new tags waiting for their registration form
+        self._last_seen = {}  # uid -> time of the last accepted read
+        self._dedup_lock = threading.Lock()
+
+    # Called from every station's reader thread; never blocks. A tag read by
+    # any station within DEDUP_SECONDS of its last accepted read is dropped.
+    def submit(self, uid, station=None):
+        now = time.monotonic()
+        with self._dedup_lock:
+            last = self._last_seen.get(uid)
+            if last is not None and now - last < DEDUP_SECONDS:
+                return False
+            self._last_seen[uid] = now
+            if len(self._last_seen) > 1000:
+                cutoff = now - DEDUP_SECONDS
+                self._last_seen = {k: t for k, t in self._last_seen.items() if t >= cutoff}
+        self.events.put(ScanEvent("tag", uid, station))
+        return True
+
+    # Called from a reader thread when a tag leaves its pad
+    def removed(self, uid, station=None):
+        self.events.put(ScanEvent("removed", uid, station))
+
+    # Called when the web app reports a registered tag
+    def registered(self, uid):
+        self.events.put(ScanEvent("registered", uid, None))
+
+    def reload(self):
+        self.chip_seq = self.store.chip_log_position()
+        self.known_chips = {row["UID"]: Sample.from_row(row) for row in self.store.active_samples()}
+        self.uid_index.load(self.store.uid_locations())
+        self.store.sync_scan_status()
+        self.scan_status = ScanStatusBuffer(self.store)
+        # Flags left by an earlier run (or read back after a full reload)
+        # get the same timers as flags set here, so none of them stays set
+        for uid, row in self.scan_status.rows.items():
+            if row["new"] and uid not in self.pending:
+                self._await_registration(uid)
+            elif row["host_scan"] and not row["new"] and ("host_scan", uid) not in self.timers:
+                self._expire_host_scan(uid)
+
+    # Pick up only the chip_data rows changed since the last look
+    def refresh_known_chips(self):
+        latest, uids = self.store.chip_changes(self.chip_seq)
+        if latest == self.chip_seq:
+            return
+        if uids is None:
+            self.scan_status.flush()
+            self.reload()
+            return
+
+        added_or_removed = False
+        for uid in uids:
+            row = self.store.get_active(uid)
+            if row:
+                added_or_removed |= uid not in self.known_chips
+                self.known_chips[uid] = Sample.from_row(row)
+            elif self.known_chips.pop(uid, None) is not None:
+                added_or_removed = True
+        for uid in uids:
+            self.uid_index.discard(uid)
+        for uid, archived, locator in self.store.uid_locations(uids):
+            self.uid_index.set(uid, archived, locator)
+        self.chip_seq = latest
+        if added_or_removed:
+            self.scan_status.flush()
+            self.store.sync_scan_status()
+
+    def run(self):
+        self.reload()
+        while True:
+            try:
+                event = self.events.get(timeout=self.timers.next_delay())
+            except queue.Empty:
+                event = None
+            # Handle everything already queued before writing anything back
+            while event is not None:
+                if event.kind == "tag":
+                    self._handle_tag(event.uid, event.station)
+                    self.processed += 1
+                elif event.kind == "registered":
+                    self._handle_registered(event.uid)
+                elif event.kind == "removed" and self.verbose:
+                    print(f"Tag {event.uid} removed{f' from {event.station}' if event.station else ''}")
+                try:
+                    event = self.events.get_nowait()
+                except queue.Empty:
+                    event = None
+            self.timers.run_due()
+            if self.scan_status.flush():
+                self.channel.send("scan")
+
+    def _handle_tag(self, uid, station):
+        if uid in self.pending:
+            return  # already waiting for its form
+        self.refresh_known_chips()  # Pick up samples added or archived since
+
+        chip_data = self.known_chips.get(uid)
+        if chip_data or uid in self.uid_index:
+            # An archived sample's tag is published as a host scan too, which
+            # the dashboard links to the archived sample; it is not offered
+            # for registration again
+            if self.verbose and chip_data:
+                print_chip(chip_data, station)
+            elif self.verbose:
+                print(f"Archived sample tag{f' at {station}' if station else ''}: {uid}")
+            self.scan_status.set(uid, host_scan=True, station=station)
+            self._expire_host_scan(uid)
+        else:
+            if self.verbose:
+                print(f"New chip detected{f' at {station}' if station else ''}")
+                print(f"UID: {uid}")
+            self.scan_status.set(uid, host_scan=True, new=True, station=station)
+            self._await_registration(uid)
+
+    # A re-tap replaces the pending expiry, extending the highlight
+    def _expire_host_scan(self, uid):
+        self.timers.schedule(("host_scan", uid), HOST_SCAN_SECONDS,
+                             lambda: self.scan_status.set(uid, host_scan=False))
+
+    def _await_registration(self, uid):
+        self.pending.add(uid)
+        self.timers.schedule(("pending", uid), PENDING_NEW_SECONDS, lambda: self._registration_timed_out(uid))
+        if "recheck" not in self.timers:
+            self.timers.schedule("recheck", REGISTRATION_RECHECK, self._recheck_registrations)
+
+    def _handle_registered(self, uid):
+        if uid not in self.pending:
+            return
+        self.pending.discard(uid)
+        self.timers.cancel(("pending", uid))
+        self.scan_status.set(uid, host_scan=False, new=False)
+        self.refresh_known_chips()  # Pick up the row app.py just added
+
+    def _registration_timed_out(self, uid):
+        print(f"Registration for {uid} timed out.")
+        self.pending.discard(uid)
+        self.scan_status.set(uid, host_scan=False, new=False)
+
+    def _recheck_registrations(self):
+        for uid in list(self.pending):
+            status = self.store.get_scan_status(uid)
+            if status is None or not status["new"]:
+                self._handle_registered(uid)
+        if self.pending:
+            self.timers.schedule("recheck", REGISTRATION_RECHECK, self._recheck_registrations)
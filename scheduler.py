@@ -0,0 +1,64 @@
+import heapq
+import itertools
+import time
+
+
+# Delayed actions on one heap, keyed so they can be found again. Scheduling
+# a key that is already pending replaces it (a re-tap just moves the
+# deadline), and cancel() drops it; replaced and cancelled entries stay in
+# the heap, marked dead, until they surface. The thread that owns the
+# scheduler sleeps for next_delay() and then calls run_due(), so every
+# timer shares that one thread instead of a thread or sleep per transition.
+class Scheduler:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._entries = {}  # key -> [when, order, key, action, alive]
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    # Function to run `action` after `delay` seconds, replacing any action
+    # already scheduled under `key`
+    def schedule(self, key, delay, action):
+        self.cancel(key)
+        entry = [self.clock() + delay, next(self._order), key, action, True]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        # Rebuild once dead entries outnumber live ones
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if entry[4]]
+            heapq.heapify(self._heap)
+
+    # Function to drop a pending action; returns whether one was pending
+    def cancel(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[4] = False
+        return True
+
+    # Seconds until the next action is due, or None when nothing is pending
+    def next_delay(self):
+        while self._heap and not self._heap[0][4]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0, self._heap[0][0] - self.clock())
+
+    # Function to run every action that is due; returns how many ran
+    def run_due(self):
+        now = self.clock()
+        ran = 0
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not entry[4]:
+                continue
+            del self._entries[entry[2]]
+            entry[3]()
+            ran += 1
+        return ran
@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+from notes_log import NotesLog
+from sample import Sample
+from sample_store import received_at
+
+SEARCH_FIELDS = ("ID", "FID", "PID", "TR")
+
+# Words, plus dotted or dashed codes such as "CR-7" or "150.100.100" kept whole
+TOKEN = re.compile(r"[0-9a-z]+(?:[-./][0-9a-z]+)*")
+
+
+# Function to split text into search terms; codes are indexed whole and by part
+def tokenize(text):
+    terms = set()
+    for token in TOKEN.findall(text.casefold()):
+        terms.add(token)
+        terms.update(re.split(r"[-./]", token))
+    return terms
+
+
+# Inverted index from search terms to samples (keyed by DR, the name of the
+# sample's folder) over every notes file, text extracted from attachments
+# and the ID, FID, PID and TR fields.
+# Sample fields follow the store's chip_data change log; notes logs are only
+# ever appended to, so each read starts at the first note not yet indexed.
+class SearchIndex:
+    def __init__(self, store, folder):
+        self.store = store
+        self.folder = folder
+        self._position = None
+        self._samples = {}      # DR -> Sample
+        self._uid_drs = {}      # UID -> DRs of its samples
+        self._field_terms = {}  # DR -> terms from its fields
+        self._fields = {}       # term -> DRs
+        self._notes = {}        # term -> DRs
+        self._files = {}        # term -> DRs, from text extracted from attachments
+        self._note_counts = {}  # DR -> notes already indexed
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        self._position = self.store.chip_log_position()
+        self._samples, self._uid_drs, self._field_terms, self._fields = {}, {}, {}, {}
+        for row in self.store.archived_samples() + self.store.active_samples():
+            self._add_sample(row)
+        if not self._note_counts and os.path.isdir(self.folder):
+            for dr in os.listdir(self.folder):
+                self._read_notes(dr)
+
+    def _add_sample(self, row):
+        sample = Sample.from_row(row)
+        dr = sample.DR
+        self._remove_sample(dr)
+        self._samples[dr] = sample
+        self._uid_drs.setdefault(sample.UID, set()).add(dr)
+        terms = set()
+        for field in SEARCH_FIELDS:
+            terms |= tokenize(sample[field])
+        self._field_terms[dr] = terms
+        for term in terms:
+            self._fields.setdefault(term, set()).add(dr)
+
+    def _remove_sample(self, dr):
+        row = self._samples.pop(dr, None)
+        if row is not None:
+            self._uid_drs.get(row["UID"], set()).discard(dr)
+        for term in self._field_terms.pop(dr, ()):
+            drs = self._fields[term]
+            drs.discard(dr)
+            if not drs:
+                del self._fields[term]
+
+    def _read_notes(self, dr):
+        sample_dir = os.path.join(self.folder, dr)
+        if not os.path.isdir(sample_dir):
+            return
+        start = self._note_counts.get(dr, 0)
+        notes = NotesLog(sample_dir).records(start)
+        self._note_counts[dr] = start + len(notes)
+        for note in notes:
+            for term in tokenize(f"{note['author']} {note['text']}"):
+                self._notes.setdefault(term, set()).add(dr)
+
+    def _refresh(self):
+        if self._position is None:
+            self._rebuild()
+            return
+        latest, uids = self.store.chip_changes(self._position)
+        if uids is None:
+            self._rebuild()
+            return
+        for uid in uids:
+            for dr in list(self._uid_drs.pop(uid, ())):
+                self._remove_sample(dr)
+            for row in reversed(self.store.samples_for_uid(uid)):
+                self._add_sample(row)
+        self._position = latest
+
+    # Function to index the notes appended to a sample's log since the last read
+    def note_added(self, dr):
+        with self._lock:
+            self._refresh()
+            self._read_notes(dr)
+
+    # Function to index text extracted from one of a sample's attachments
+    def text_added(self, dr, text):
+        with self._lock:
+            for term in tokenize(text):
+                self._files.setdefault(term, set()).add(dr)
+
+    # Function to find samples matching every term of the query, newest first
+    def search(self, query, limit=50):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            self._refresh()
+            matches = None
+            for term in terms:
+                drs = self._fields.get(term, set()) | self._notes.get(term, set()) | self._files.get(term, set())
+                matches = drs if matches is None else matches & drs
+                if not matches:
+                    return []
+            results = []
+            for dr in matches:
+                sample = self._samples.get(dr)
+                result = {field: sample[field] if sample else "" for field in ("ID", "UID", "FID", "PID", "TR")}
+                result["DR"] = dr
+                result["Status"] = "" if sample is None else sample["Status"] if sample.active else "Archived"
+                result["in_notes"] = any(dr in self._notes.get(term, ()) for term in terms)
+                result["in_files"] = any(dr in self._files.get(term, ()) for term in terms)
+                results.append(result)
+        results.sort(key=lambda result: received_at(result["DR"]), reverse=True)
+        return results[:limit]
@@ -0,0 +1,61 @@
+import collections
+import os
+import threading
+
+
+# Identify the current version of each file by (mtime, size, inode), so a
+# rewrite, an append or an atomic replace all count as a change
+def file_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+    return tuple(signature)
+
+
+class Snapshot:
+    __slots__ = ("signature", "rows", "body")
+
+    def __init__(self, signature, rows, body):
+        self.signature = signature
+        self.rows = rows
+        self.body = body
+
+
+# Process-wide cache of parsed rows and their serialized JSON. Entries are
+# rebuilt only when the signature changes, so unchanged polls cost one stat
+# per file instead of a full read and serialization. At most `max_entries`
+# keys are kept; the oldest is dropped first.
+class SnapshotCache:
+    def __init__(self, signature, dumps, max_entries=128):
+        self._signature = signature
+        self._dumps = dumps
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        signature = self._signature()
+        entry = self._entries.get(key)
+        if entry is not None and entry.signature == signature:
+            return entry
+
+        # Build under the lock so simultaneous polls do not all rebuild
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature:
+                return entry
+            rows = build()
+            entry = Snapshot(signature, rows, self._dumps(rows).encode("utf-8"))
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,12 +1,10 @@
 import os
-import board
-import busio
 import csv
 import datetime
 import time
 import threading
 from flask import Flask, render_template_string, jsonify, request, redirect, url_for
-from adafruit_pn532.i2c import PN532_I2C
+from readers import PN532Reader
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -15,16 +13,8 @@ app = Flask(__name__)
 CHIP_DATA_FILE = "chip_data.csv"
 SCAN_STATUS_FILE = "scan_status.csv"
 
-# Initialize I2C for NFC scanner
-i2c = busio.I2C(board.SCL, board.SDA)
-pn532 = PN532_I2C(i2c, debug=False)
-
-# Get firmware version
-ic, ver, rev, support = pn532.firmware_version
-print(f"Found PN532 with firmware version: {ver}.{rev}")
-
-# Configure NFC reader
-pn532.SAM_configuration()
+# Initialize the NFC reader
+reader = PN532Reader()
 
 # Dictionary to store known chip data
 known_chips = {}
@@ -127,9 +117,8 @@ def update_scan_status(uid, is_new):
 def scan_nfc():
     print("Starting NFC scanning...")
     while True:
-        uid = pn532.read_passive_target(timeout=0.5)
-        if uid:
-            uid_hex = uid.hex()
+        uid_hex = reader.read(timeout=0.5)
+        if uid_hex:
             is_new = uid_hex not in known_chips
             if not is_new:
                 chip_data = known_chips[uid_hex]
@@ -0,0 +1,90 @@
+import array
+import bisect
+
+# Tag UIDs are 4 or 7 bytes. Each is packed with its length into one 64-bit
+# key (length in the top byte, UID bytes left-aligned below it), so every
+# known tag costs 8 bytes of key, 1 byte of state and 8 bytes of locator.
+MAX_UID_BYTES = 7
+
+
+def pack_uid(uid):
+    try:
+        raw = bytes.fromhex(uid)
+    except (TypeError, ValueError):
+        return None
+    if not raw or len(raw) > MAX_UID_BYTES:
+        return None
+    return (len(raw) << 56) | int.from_bytes(raw.ljust(MAX_UID_BYTES, b"\0"), "big")
+
+
+# Membership index over every UID ever registered, active or archived, kept
+# as parallel sorted arrays and searched with bisect, so a lookup is
+# O(log n) without holding any sample rows. Each UID maps to (archived,
+# locator): the chip_data rowid of an active sample or the archive seq of
+# an archived one. UIDs that do not pack fall back to a plain dict.
+class UidIndex:
+    def __init__(self):
+        self._keys = array.array("Q")
+        self._archived = bytearray()
+        self._locators = array.array("Q")
+        self._other = {}
+
+    def __len__(self):
+        return len(self._keys) + len(self._other)
+
+    def __contains__(self, uid):
+        return self.get(uid) is not None
+
+    # Function to replace the contents with (uid, archived, locator) entries;
+    # a later entry for the same UID wins
+    def load(self, entries):
+        packed, self._other = {}, {}
+        for uid, archived, locator in entries:
+            key = pack_uid(uid)
+            if key is None:
+                self._other[uid] = (bool(archived), locator)
+            else:
+                packed[key] = (archived, locator)
+        keys = sorted(packed)
+        self._keys = array.array("Q", keys)
+        self._archived = bytearray(1 if packed[key][0] else 0 for key in keys)
+        self._locators = array.array("Q", (packed[key][1] or 0 for key in keys))
+
+    def _find(self, key):
+        position = bisect.bisect_left(self._keys, key)
+        return position, position < len(self._keys) and self._keys[position] == key
+
+    # Function to look up a UID; returns (archived, locator) or None
+    def get(self, uid):
+        key = pack_uid(uid)
+        if key is None:
+            return self._other.get(uid)
+        position, found = self._find(key)
+        if not found:
+            return None
+        return bool(self._archived[position]), self._locators[position]
+
+    def set(self, uid, archived, locator):
+        key = pack_uid(uid)
+        if key is None:
+            self._other[uid] = (bool(archived), locator)
+            return
+        position, found = self._find(key)
+        if found:
+            self._archived[position] = 1 if archived else 0
+            self._locators[position] = locator or 0
+        else:
+            self._keys.insert(position, key)
+            self._archived.insert(position, 1 if archived else 0)
+            self._locators.insert(position, locator or 0)
+
+    def discard(self, uid):
+        key = pack_uid(uid)
+        if key is None:
+            self._other.pop(uid, None)
+            return
+        position, found = self._find(key)
+        if found:
+            del self._keys[position]
+            del self._archived[position]
+            del self._locators[position]
@@ -0,0 +1,64 @@
+import hashlib
+import os
+import tempfile
+import time
+
+UPLOAD_PREFIX = ".upload-"
+# Temp files older than this are left from a crash, not an upload in progress
+STALE_UPLOAD_SECONDS = 24 * 60 * 60
+
+
+# Destination for one uploaded file while the request body is parsed. Chunks
+# go straight to a temp file next to the samples and are hashed as they
+# arrive, so an upload never sits in memory and never needs a second read.
+class UploadFile:
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix=UPLOAD_PREFIX)
+        self.file = os.fdopen(fd, "w+b")
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.saved = False
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    # Reads, seeks and the rest go to the temp file
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    # Function to move the finished upload into place; returns its SHA-256
+    def save_as(self, destination):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path, destination)
+        self.saved = True
+        return self.sha256.hexdigest()
+
+    # Called when the request ends; drops the temp file if it was not saved
+    def close(self):
+        self.file.close()
+        if not self.saved:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+# Function to delete temp files left by uploads that never finished, such as
+# when the server was killed mid-request; returns how many were removed
+def remove_stale_uploads(folder, max_age=STALE_UPLOAD_SECONDS):
+    removed = 0
+    cutoff = time.time() - max_age
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if name.startswith(UPLOAD_PREFIX) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed